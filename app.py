@@ -1,77 +1,159 @@
-import base64
+import asyncio
 import json
+from functools import partial
 
 import markupsafe
+from bson import ObjectId
+from bson.errors import InvalidId
+from gridfs import GridOut
 from flask import Flask, render_template, abort, request, jsonify
-from flask_paginate import get_page_args, Pagination
 from flask_simplelogin import SimpleLogin
-from lxml import etree, html
+from werkzeug.wsgi import wrap_file
 
+import db.mongo
+import search.elastic
+from helpers.aio import gather_io
+from helpers.page_cache import cached_page, page_cache
 from helpers.save_article_id import save_id_from_title
 from models.aco import ACOMeta
-from models.file import ACOFile
-from models.oeaz_structured import OeazArticle, OeazStructuredIssue
-from search.elastic import search_aco_bezeichnung, search_oeaz_bezeichnung, search_articles
+from models.file import ACOFile, ACOFileVariant, VARIANTS, file_loader
+from models.nav_tree import NavTree
+from models.oeaz_structured import OeazArticle, OeazStructuredIssue, OeazArticleSummary
+from search.elastic import cached_search_aco_bezeichnung, cached_search_oeaz_bezeichnung, search_articles, \
+    typeahead_cache, index_generation, OEAZ_INDICES
 
 app = Flask(__name__, template_folder='templates', static_folder="static")
 app.config['SECRET_KEY'] = 'something-secret'
 app.config['SIMPLELOGIN_USERNAME'] = 'apo'
 app.config['SIMPLELOGIN_PASSWORD'] = 'pass123!'
 SimpleLogin(app)
+FILE_BUFFER_SIZE = 255 * 1024 # gridfs chunk size
+FILE_MAX_AGE = 365 * 24 * 3600
+db.mongo.init_app(app)
+search.elastic.init_app(app)
 
 @app.get('/oeaz', defaults={'year': None, 'month': None})
 @app.get('/oeaz/<int:year>/<int:month>/')
+@cached_page()
 def index_oeaz(year=None, month=None):
-    # page, per_page, offset = get_page_args(page_parameter='page', per_page_parameter='per_page')
-    # pagination = Pagination(page=page, per_page=per_page, total=OeazArticle.count())
-    treelist = OeazArticle.get_pubyear_tree()
+    treelist = NavTree.get_tree("oeaz")
     tree_str = json.dumps(treelist)
     if not month:
         year = treelist[-1]["text"]
         month = treelist[-1]["nodes"][-1]["text"]
-    data_page = OeazArticle.get_by_month_and_year_sorted(month=month, year=year, sort=1)
-    return render_template('index_oeaz.html', data_page=data_page, tree=tree_str, data_type="oeaz")
+    try:
+        page = OeazArticleSummary.get_page_by_month_and_year(month=month, year=year, page_token=request.args.get("page"))
+    except ValueError:
+        abort(400)
+    return render_template('index_oeaz.html', data_page=page.items, page=page, tree=tree_str, data_type="oeaz")
 
 @app.get('/oeaz/detail/<article_id>/')
-def detail_article(article_id:int):
-    article:OeazArticle = OeazArticle.get(id=int(article_id))
+@cached_page()
+async def detail_article(article_id:int):
+    article:OeazArticle = await asyncio.to_thread(OeazArticle.get_for_display, id=int(article_id))
     if not article:
         abort(404)
-    treelist = OeazArticle.get_pubmonth_tree(year=article.pubdate.year, month=article.pubdate.month)
+    treelist = await asyncio.to_thread(OeazArticle.get_pubmonth_tree, year=article.pubdate.year, month=article.pubdate.month)
     tree_str = json.dumps(treelist)
 
-    images = [base64.b64encode(ACOFile.get_by_objid(i).source).decode() for i in article.images]
+    # the browser loads (and caches) the images from /files/<objid>
+    images = [str(i) for i in article.images]
 
-    article.html_raw = [markupsafe.Markup(etree.tounicode(a)) for a in html.fromstring(article.html_raw).xpath("//body/*")]
-    return render_template('detail_oeaz.html', article=article, tree=tree_str, images=images, data_type="oeaz")
+    body = [markupsafe.Markup(h) for h in article.html_body]
+    return render_template('detail_oeaz.html', article=article, body=body, tree=tree_str, images=images, data_type="oeaz")
 
 @app.route('/oeaz/search', methods=['POST'])
 def oeaz_search():
     query = request.json.get('query', '').lower()
-    results = [r for r in search_oeaz_bezeichnung(query)]
+    results = [r for r in cached_search_oeaz_bezeichnung(query)]
     return jsonify(results)
 
 
+def send_cached(file:ACOFile, etag:str):
+    rv = app.response_class(file.source, mimetype=file.mimetype)
+    rv.set_etag(etag)
+    rv.cache_control.public = True
+    rv.cache_control.max_age = FILE_MAX_AGE
+    rv.cache_control.immutable = True
+    return rv.make_conditional(request, accept_ranges=True, complete_length=len(file.source))
+
+
+def send_grid_out(grid_out:GridOut, etag:str):
+    # small (hot) files are read once and then served from memory; a revalidation with the
+    # current etag takes the streaming path below, which answers 304 without reading the file
+    if file_loader.cacheable(grid_out.length) and not request.if_none_match.contains_weak(etag):
+        return send_cached(file_loader.load(grid_out, key=etag), etag)
+    # gridfs files never change under their objid: strong etag, cacheable for a year;
+    # make_conditional answers If-None-Match with 304 and Range with 206 before any chunk is read
+    rv = app.response_class(wrap_file(request.environ, grid_out, buffer_size=FILE_BUFFER_SIZE),
+                            mimetype=grid_out._file.get("mimetype", "application/octet-stream"),
+                            direct_passthrough=True)
+    rv.content_length = grid_out.length
+    rv.set_etag(etag)
+    rv.cache_control.public = True
+    rv.cache_control.max_age = FILE_MAX_AGE
+    rv.cache_control.immutable = True
+    return rv.make_conditional(request, accept_ranges=True, complete_length=grid_out.length)
+
+
+@app.get('/files/stats')
+def file_stats():
+    return jsonify(file_loader.cache.stats())
+
+
+@app.get('/files/<objid>')
+def get_file(objid:str):
+    if cached := file_loader.cache.get(objid):
+        return send_cached(cached, etag=objid)
+    try:
+        grid_out = ACOFile.open_by_objid(ObjectId(objid))
+    except InvalidId:
+        abort(404)
+    if grid_out is None:
+        abort(404)
+    return send_grid_out(grid_out, etag=objid)
+
+
+@app.get('/files/<objid>/<variant>')
+def get_file_variant(objid:str, variant:str):
+    if variant not in VARIANTS:
+        abort(404)
+    if cached := file_loader.cache.get(f"{objid}-{variant}"):
+        return send_cached(cached, etag=f"{objid}-{variant}")
+    try:
+        grid_out = ACOFileVariant.get_or_create(ObjectId(objid), variant)
+    except InvalidId:
+        abort(404)
+    if grid_out is None:
+        abort(404)
+    return send_grid_out(grid_out, etag=f"{objid}-{variant}")
+
+
 @app.get('/') #aco aco/
 @app.get('/aco/<bez_start>/')
+@cached_page()
 def index_aco(bez_start=None):
-    treelist = ACOMeta.get_by_name_groups()
+    treelist = NavTree.get_tree("aco")
     tree_str = json.dumps(treelist)
     if bez_start is None:
         bez_start = treelist[0]["nodes"][0]["text"]
-    data_page = ACOMeta.get_by_bez_start(bez_start)
-    return render_template('index_aco.html', data_page=data_page, tree=tree_str, data_type="aco")
+    try:
+        page = ACOMeta.get_by_bez_start(bez_start, page_token=request.args.get("page"))
+    except ValueError:
+        abort(400)
+    return render_template('index_aco.html', data_page=page.items, page=page, tree=tree_str, data_type="aco")
 
 
 @app.get('/aco/detail/<aco_id>/')
-def detail_aco(aco_id:int):
+# related articles come from the oeaz indices
+@cached_page(version=lambda: index_generation(OEAZ_INDICES))
+async def detail_aco(aco_id:int):
     #todo: ACOMeta id needs int id
-    aco:ACOMeta = ACOMeta.get(id=int(aco_id))
+    aco, treelist = await gather_io(partial(ACOMeta.get, id=int(aco_id)), partial(NavTree.get_tree, "aco"))
     if not aco:
         abort(404)
-    treelist = ACOMeta.get_by_name_groups()
     tree_str = json.dumps(treelist)
-    related_articles = search_articles(aco)
+    related_articles = await asyncio.to_thread(search_articles, aco)
 
     #article.html_raw = [markupsafe.Markup(etree.tounicode(a)) for a in html.fromstring(article.html_raw).xpath("//body/*")]
     return render_template('detail_aco.html',
@@ -85,12 +167,16 @@ def detail_aco(aco_id:int):
 @app.route('/aco/search', methods=['POST'])
 def aco_search():
     query = request.json.get('query', '').lower()
-    results = [r for r in search_aco_bezeichnung(query)]
+    results = [r for r in cached_search_aco_bezeichnung(query)]
     return jsonify(results)
 
-@app.get("/hello/{name}")
-async def say_hello(name: str):
-    return {"message": f"Hello {name}"}
+@app.get('/search/stats')
+def search_stats():
+    return jsonify(typeahead_cache.stats())
+
+@app.get('/pages/stats')
+def page_stats():
+    return jsonify(page_cache.stats())
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
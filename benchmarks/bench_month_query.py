@@ -0,0 +1,79 @@
+"""
+compares the old $expr month/year filter with the pubdate range query on a scratch copy
+of oeaz_article that grows decade by decade:
+
+    python -m benchmarks.bench_month_query --articles-per-month 60 --decades 7
+"""
+import argparse
+import datetime
+import time
+
+import settings
+from db.mongo import get_db
+from models.oeaz_structured import OeazArticle
+
+logger = settings.logger
+
+BENCH_COLLECTION = "bench_oeaz_article"
+START_YEAR = 1950
+MONTH_SORT = [("pubdate", 1), ("id", 1)] # the order of get_by_month_and_year_sorted
+
+
+def expr_query(month: int, year: int):
+    return {
+        "$expr": {
+            "$and": [{"$eq": [{"$month": "$pubdate"}, month]},
+                     {"$eq": [{"$year": "$pubdate"}, year]}]
+        }
+    }
+
+
+def fill_decade(collection, decade: int, articles_per_month: int):
+    docs = []
+    for year in range(START_YEAR + decade * 10, START_YEAR + (decade + 1) * 10):
+        for month in range(1, 13):
+            for n in range(articles_per_month):
+                docs.append({
+                    "id": int(f"{year}{month:02}{n:04}"),
+                    "title": f"article {n}",
+                    "rubrik": "Pharmazie Tara Medizin",
+                    "pubdate": datetime.datetime(year, month, 1 + n % 28),
+                    "html_raw": "x" * 2000
+                })
+    collection.insert_many(docs, ordered=False)
+
+
+def measure(collection, query, repeat: int):
+    stats = collection.find(query).sort(MONTH_SORT).explain()["executionStats"]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        list(collection.find(query, {"id": 1}).sort(MONTH_SORT))
+    ms = (time.perf_counter() - started) * 1000 / repeat
+    return stats["nReturned"], stats["totalDocsExamined"], stats["totalKeysExamined"], ms
+
+
+def run(articles_per_month: int, decades: int, repeat: int):
+    collection = get_db()[BENCH_COLLECTION]
+    collection.drop()
+    collection.create_index([('pubdate', 1), ('id', 1)])
+    try:
+        print(f"{'years':>6} {'docs':>9} {'query':>6} {'returned':>9} {'docs exam.':>11} {'keys exam.':>11} {'ms':>8}")
+        for decade in range(decades):
+            fill_decade(collection, decade, articles_per_month)
+            year = START_YEAR + decade * 10 + 5
+            total = collection.estimated_document_count()
+            for name, query in [("$expr", expr_query(6, year)),
+                                ("range", OeazArticle.month_range_query(month=6, year=year))]:
+                returned, docs, keys, ms = measure(collection, query, repeat)
+                print(f"{(decade + 1) * 10:>6} {total:>9} {name:>6} {returned:>9} {docs:>11} {keys:>11} {ms:>8.2f}")
+    finally:
+        collection.drop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles-per-month", type=int, default=60)
+    parser.add_argument("--decades", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    run(args.articles_per_month, args.decades, args.repeat)
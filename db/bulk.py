@@ -0,0 +1,55 @@
+import time
+from typing import Iterable
+
+from pydantic import BaseModel
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import settings
+from helpers.group import chunked
+
+logger = settings.logger
+
+BATCH_SIZE = 1000
+
+
+class BulkWriteReport(BaseModel):
+    label: str
+    batches: int = 0
+    operations: int = 0
+    upserted: int = 0
+    modified: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+    def __str__(self):
+        return f"{self.label}: {self.operations} ops in {self.batches} batches, {self.seconds:.1f}s, " \
+               f"{self.upserted} upserted, {self.modified} modified, {self.errors} errors"
+
+
+def bulk_write_batches(collection, operations: Iterable[UpdateOne], batch_size: int = BATCH_SIZE,
+                       label: str = "bulk_write") -> BulkWriteReport:
+    """
+    writes a (lazy) stream of operations as unordered bulk_write batches of batch_size,
+    so only one batch is held in memory
+    """
+    report = BulkWriteReport(label=label)
+    started = time.perf_counter()
+    for batch in chunked(operations, batch_size):
+        batch_started = time.perf_counter()
+        try:
+            result = collection.bulk_write(batch, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            for error in result["writeErrors"][:3]:
+                logger.warning(f"{label}: {error['errmsg']}")
+        report.batches += 1
+        report.operations += len(batch)
+        report.upserted += result["nUpserted"]
+        report.modified += result["nModified"]
+        report.errors += len(result["writeErrors"])
+        logger.info(f"{label}: batch {report.batches} with {len(batch)} ops took "
+                    f"{(time.perf_counter() - batch_started) * 1000:.0f} ms, {len(result['writeErrors'])} errors")
+    report.seconds = time.perf_counter() - started
+    logger.info(str(report))
+    return report
@@ -0,0 +1,70 @@
+import base64
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from bson import json_util
+from pydantic import BaseModel
+
+PAGE_SIZE = 100
+COUNT_LIMIT = 10000 # totals stop counting here, shown as "10000+"
+
+
+class KeysetPage(BaseModel):
+    items: List[Any]
+    next: Union[str, None] = None
+    prev: Union[str, None] = None
+    total: int = 0
+    total_capped: bool = False
+
+
+def encode_token(direction: str, key: List) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps([direction, key]).encode()).decode()
+
+
+def decode_token(token: str, key_type: type) -> Tuple[str, List]:
+    """
+    direction and boundary key of token; the key is merged into the query, so anything but
+    a (key_type, int) pair (e.g. an operator document) is rejected
+    """
+    try:
+        direction, key = json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise ValueError(f"invalid page token {token}")
+    if direction not in ("next", "prev") or not isinstance(key, list) or len(key) != 2 \
+            or not isinstance(key[0], key_type) \
+            or not isinstance(key[1], int) or isinstance(key[1], bool):
+        raise ValueError(f"invalid page token {token}")
+    return direction, key
+
+
+def keyset_page(collection, query: Dict, sort_field: str, key_type: type, projection: Dict, build: Callable[[Dict], Any],
+                token: Union[str, None] = None, page_size: int = PAGE_SIZE) -> KeysetPage:
+    """
+    one page of collection ordered by (sort_field, id), sort_field values being of key_type; the tokens
+    hold the boundary key of the page, so a page costs an index seek instead of skipping all previous pages
+    """
+    direction, key = decode_token(token, key_type) if token else ("next", None)
+    order = 1 if direction == "next" else -1
+    page_query = query
+    if key is not None:
+        op = "$gt" if direction == "next" else "$lt"
+        page_query = {"$and": [query, {"$or": [{sort_field: {op: key[0]}},
+                                               {sort_field: key[0], "id": {op: key[1]}}]}]}
+    # an empty projection means whole documents
+    fields = {**projection, sort_field: 1, "id": 1} if projection else None
+    docs = list(collection.find(page_query, fields)
+                .sort([(sort_field, order), ("id", order)])
+                .limit(page_size + 1))
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+    if direction == "prev":
+        docs.reverse()
+
+    page = KeysetPage(items=[build(d) for d in docs])
+    if docs:
+        if has_more or direction == "prev":
+            page.next = encode_token("next", [docs[-1][sort_field], docs[-1]["id"]])
+        if has_more if direction == "prev" else key is not None:
+            page.prev = encode_token("prev", [docs[0][sort_field], docs[0]["id"]])
+    page.total = collection.count_documents(query, limit=COUNT_LIMIT)
+    page.total_capped = page.total >= COUNT_LIMIT
+    return page
@@ -0,0 +1,64 @@
+import hashlib
+
+from pymongo import UpdateOne
+
+import settings
+from helpers.normalize import sort_key
+from db.mongo import sis, aco, oeaz_pdf, oeaz_structured, oeaz_article, tombstones, sync_state, fs_files, nav_trees, \
+    file_refs, fs
+
+logger = settings.logger
+
+
+def ensure_indexes():
+    sis.create_index([('id', 1)], unique=True)
+    aco.create_index([('id', 1)], unique=True)
+    oeaz_pdf.create_index([('id', 1)], unique=True)
+    oeaz_structured.create_index([('id', 1)], unique=True)
+    oeaz_article.create_index([('id', 1)], unique=True)
+    fs_files.create_index([('id', 1)], unique=True)
+    fs_files.create_index([('source_id', 1), ('variant', 1)], unique=True, sparse=True)
+    fs_files.create_index([('sha256', 1)])
+    file_refs.create_index([('id', 1)], unique=True)
+    aco.create_index([('updated_at', 1)])
+    aco.create_index([('bez_key', 1), ('id', 1)])
+    oeaz_article.create_index([('updated_at', 1)])
+    oeaz_article.create_index([('pubdate', 1), ('id', 1)])
+    tombstones.create_index([('collection', 1), ('updated_at', 1)])
+    sync_state.create_index([('name', 1)], unique=True)
+    nav_trees.create_index([('name', 1)], unique=True)
+    logger.info("indexes ensured")
+
+
+def backfill_bez_key(batch_size: int = 1000):
+    operations = []
+    count = 0
+    for doc in aco.find({"bez_key": {"$exists": False}}, {"_id": 1, "bezeichnung": 1}):
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"bez_key": sort_key(doc["bezeichnung"])}}))
+        if len(operations) >= batch_size:
+            aco.bulk_write(operations, ordered=False)
+            count += len(operations)
+            operations.clear()
+    if operations:
+        aco.bulk_write(operations, ordered=False)
+        count += len(operations)
+    logger.info(f"backfilled bez_key for {count} aco entries")
+
+
+def backfill_sha256():
+    # content hashes for files stored before dedup, originals only
+    count = 0
+    for doc in fs_files.find({"sha256": {"$exists": False}, "variant": {"$exists": False}}, {"_id": 1}):
+        digest = hashlib.sha256()
+        grid_out = fs.get(doc["_id"])
+        while chunk := grid_out.readchunk():
+            digest.update(chunk)
+        fs_files.update_one({"_id": doc["_id"]}, {"$set": {"sha256": digest.hexdigest()}})
+        count += 1
+    logger.info(f"backfilled sha256 for {count} files")
+
+
+if __name__ == '__main__':
+    ensure_indexes()
+    backfill_bez_key()
+    backfill_sha256()
@@ -1,51 +1,141 @@
 import logging
+import os
+import threading
 from datetime import datetime
+from typing import Union, Dict, List, Tuple, Generator
 
 from pymongo import MongoClient, ASCENDING
+from pymongo.database import Database
 import gridfs
 import settings
 
 logger = settings.logger
 
-client = MongoClient(settings.MONGO_ENDPOINT)
-db = client.aco
-sis = db["sis"]
-aco = db["aco"]
-oeaz_pdf = db["oeaz_pdf"]
-oeaz_structured = db["oeaz_structured"]
-oeaz_article = db["oeaz_article"]
-fs = gridfs.GridFS(db)
-
-sis.create_index([('id', 1)], unique=True)
-aco.create_index([('id', 1)], unique=True)
-oeaz_pdf.create_index([('id', 1)], unique=True)
-oeaz_structured.create_index([('id', 1)], unique=True)
-oeaz_article.create_index([('id', 1)], unique=True)
-db.fs.files.create_index([('id', 1)], unique=True)
+_client: Union[MongoClient, None] = None
+_client_pid: Union[int, None] = None
+_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """
+    process wide client, created on first use; a forked worker gets its own client
+    instead of the (not fork safe) one of its parent
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = MongoClient(settings.MONGO_ENDPOINT)
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_db() -> Database:
+    return get_client().aco
+
+
+def init_app(app) -> None:
+    app.extensions["mongo"] = get_client
+
+
+class LazyCollection:
+    """
+    stands in for a pymongo collection at import time, resolves it from get_db() on every access
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self.name], attr)
+
+
+class LazyGridFS:
+    _fs: Union[gridfs.GridFS, None] = None
+    _fs_pid: Union[int, None] = None
+
+    def __getattr__(self, attr):
+        if self._fs is None or self._fs_pid != os.getpid():
+            self._fs = gridfs.GridFS(get_db())
+            self._fs_pid = os.getpid()
+        return getattr(self._fs, attr)
+
+
+sis = LazyCollection("sis")
+aco = LazyCollection("aco")
+oeaz_pdf = LazyCollection("oeaz_pdf")
+oeaz_structured = LazyCollection("oeaz_structured")
+oeaz_article = LazyCollection("oeaz_article")
+tombstones = LazyCollection("tombstones")
+sync_state = LazyCollection("sync_state")
+nav_trees = LazyCollection("nav_trees")
+file_refs = LazyCollection("file_refs")
+fs_files = LazyCollection("fs.files")
+fs = LazyGridFS()
 
 class LongSessionCursor():
-    def __init__(self, collection, query) -> None:
-        self.client = MongoClient()
-        self.session = client.start_session()
-        self.sessionId = self.session.session_id
+    """
+    find() cursor on the process wide client. long_running cursors (bulk scans) get no server
+    timeout and an explicit session that is refreshed every SESSION_REFRESH seconds; short
+    reads use a plain cursor. Closed when iter()/batches() finish, on close() or as context manager.
+    """
+    SESSION_REFRESH = 300
+
+    def __init__(self, collection, query, projection: Union[Dict, None] = None,
+                 sort: Union[List[Tuple[str, int]], None] = None, batch_size: int = 0,
+                 long_running: bool = True) -> None:
         self.collection = collection
-        self.cursor = collection.find(query, no_cursor_timeout=True)
+        self.long_running = long_running
+        self.session = get_client().start_session() if long_running else None
+        self.cursor = collection.find(query, projection,
+                                      sort=sort,
+                                      batch_size=batch_size,
+                                      no_cursor_timeout=long_running,
+                                      session=self.session)
         self.refresh_timestamp = datetime.now()
 
-    def iter(self):
+    def __enter__(self) -> 'LongSessionCursor':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def __iter__(self) -> Generator[Dict, None, None]:
+        return self.iter()
+
+    def _refresh_session(self) -> None:
+        if not self.long_running: return
+        if (datetime.now() - self.refresh_timestamp).total_seconds() > self.SESSION_REFRESH:
+            logger.info("refreshing session")
+            self.session.client.admin.command({"refreshSessions": [self.session.session_id]})
+            self.refresh_timestamp = datetime.now()
+
+    def iter(self) -> Generator[Dict, None, None]:
         try:
             for document in self.cursor:
-                if (datetime.now() - self.refresh_timestamp).total_seconds() > 300:
-                    logger.info("refreshing session")
-                    self.session.client.admin.command({"refreshSessions": [self.sessionId]})
-                    self.refresh_timestamp = datetime.now()
+                self._refresh_session()
                 yield document
-            return None
         except Exception as e:
             logger.error(e, exc_info=True)
+            raise
         finally:
-            self.cursor.close()
+            self.close()
+
+    def batches(self, size: int) -> Generator[List[Dict], None, None]:
+        batch = []
+        for document in self.iter():
+            batch.append(document)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def close(self) -> None:
+        try: self.cursor.close()
+        except: pass
+        if self.session is not None:
+            self.session.end_session()
+            self.session = None
 
     def close_cursor(self):
-        try:self.cursor.close()
-        except:pass
\ No newline at end of file
+        self.close()
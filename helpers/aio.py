@@ -0,0 +1,18 @@
+import asyncio
+from typing import Any, Callable, List
+
+IO_CONCURRENCY = 8
+
+
+async def gather_io(*calls: Callable[[], Any], limit: int = IO_CONCURRENCY) -> List[Any]:
+    """
+    runs blocking calls (pymongo, elasticsearch, gridfs) in worker threads, at most limit at a time,
+    and returns their results in order
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _run(call: Callable[[], Any]) -> Any:
+        async with semaphore:
+            return await asyncio.to_thread(call)
+
+    return await asyncio.gather(*(_run(call) for call in calls))
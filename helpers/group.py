@@ -1,5 +1,6 @@
+import itertools
 from collections import defaultdict
-from typing import List, Dict
+from typing import List, Dict, Iterable, Generator, Any
 
 
 def group_object(in_list:List[Dict], attr:str):
@@ -8,4 +9,10 @@ def group_object(in_list:List[Dict], attr:str):
     for obj in in_list:
         groups[obj[attr]].append(obj)
 
-    return groups
\ No newline at end of file
+    return groups
+
+
+def chunked(items: Iterable[Any], size: int) -> Generator[List[Any], None, None]:
+    it = iter(items)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
@@ -0,0 +1,16 @@
+import unicodedata
+from typing import Dict
+
+
+def sort_key(text: str) -> str:
+    """
+    case and accent insensitive key: lowercase, umlauts/accents folded to the base letter, ß -> ss
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def prefix_range(prefix: str) -> Dict[str, str]:
+    # all strings starting with prefix, as a range an index can serve
+    if not prefix: return {"$gte": ""}
+    return {"$gte": prefix, "$lt": prefix[:-1] + chr(ord(prefix[-1]) + 1)}
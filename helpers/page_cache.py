@@ -0,0 +1,88 @@
+import functools
+import hashlib
+import inspect
+from typing import Any, Callable, Hashable, Tuple
+
+from flask import request, current_app, make_response
+
+import settings
+from db.mongo import sync_state
+from helpers.cache import ByteLRUCache, TTLCache
+
+logger = settings.logger
+
+PAGE_CACHE_BYTES = 64 * 1024 * 1024
+VERSION_CHECK = 10 # seconds a process trusts its content version before reading it again
+VERSION_NAME = "page_cache"
+
+# key -> (etag, body, mimetype); the content version is part of the key, so purged pages are never hit again
+page_cache = ByteLRUCache(max_bytes=PAGE_CACHE_BYTES)
+_version_cache = TTLCache(maxsize=1, ttl=VERSION_CHECK)
+
+
+def content_version() -> int:
+    """
+    counter in sync_state, bumped by purge_pages; shared by all processes serving pages
+    """
+    def _load() -> int:
+        state = sync_state.find_one({"name": VERSION_NAME}, {"version": 1})
+        return state["version"] if state else 0
+    return _version_cache.get_or_load(VERSION_NAME, _load)
+
+
+def purge_pages() -> None:
+    """
+    invalidates every cached page; called by ingestion (model saves, sync) and reindexing.
+    this process drops its pages at once, other processes within VERSION_CHECK seconds
+    """
+    sync_state.update_one({"name": VERSION_NAME}, {"$inc": {"version": 1}}, upsert=True)
+    _version_cache.clear()
+    page_cache.clear()
+
+
+def _cache_key(version: Callable[[], Hashable]) -> Tuple:
+    return (request.endpoint, request.path, tuple(sorted(request.args.items(multi=True))),
+            content_version(), version())
+
+
+def _respond(etag: str, body: bytes, mimetype: str):
+    rv = current_app.response_class(body, mimetype=mimetype)
+    rv.set_etag(etag)
+    # pages change with every ingestion: browsers revalidate, unchanged pages cost a 304
+    rv.cache_control.no_cache = True
+    return rv.make_conditional(request)
+
+
+def _store(key: Tuple, rv: Any):
+    response = make_response(rv)
+    if response.status_code != 200 or response.direct_passthrough:
+        return response
+    body = response.get_data()
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    page_cache.put(key, (etag, body, response.mimetype), size=len(body))
+    return _respond(etag, body, response.mimetype)
+
+
+def cached_page(version: Callable[[], Hashable] = lambda: None):
+    """
+    caches the rendered response of a GET view by route, path, query args and content version;
+    version adds what else the page depends on (e.g. the active search index generations).
+    responses carry a strong etag and If-None-Match is answered with 304.
+    """
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(*args, **kwargs):
+                key = _cache_key(version)
+                if cached := page_cache.get(key):
+                    return _respond(*cached)
+                return _store(key, await view(*args, **kwargs))
+        else:
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = _cache_key(version)
+                if cached := page_cache.get(key):
+                    return _respond(*cached)
+                return _store(key, view(*args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,26 @@
+"""
+renders html_body for articles stored before it existed or with an older HTML_BODY_VERSION:
+
+    python -m ingest.backfill_html_body
+"""
+from pymongo import UpdateOne
+
+import settings
+from db.bulk import bulk_write_batches
+from db.mongo import oeaz_article
+from models.oeaz_structured import OeazArticle, HTML_BODY_VERSION, render_html_body
+
+logger = settings.logger
+
+
+def backfill_html_body(batch_size: int = 500):
+    documents = OeazArticle.get_dicts_by_query({"html_body_version": {"$ne": HTML_BODY_VERSION}},
+                                               projection={"_id": 1, "html_raw": 1}, batch_size=batch_size)
+    operations = (UpdateOne({"_id": d["_id"]}, {"$set": {"html_body": render_html_body(d.get("html_raw", "")),
+                                                         "html_body_version": HTML_BODY_VERSION}})
+                  for d in documents)
+    return bulk_write_batches(oeaz_article, operations, batch_size=batch_size, label="backfill html_body")
+
+
+if __name__ == '__main__':
+    backfill_html_body()
@@ -0,0 +1,81 @@
+"""
+local stand-in for the OEAZ REST api with synthetic articles, for running ingest.oeaz_rest:
+
+    python -m ingest.fixture_server --articles 5000 --port 8765
+    python -m ingest.oeaz_rest --api http://localhost:8765 --full
+"""
+import argparse
+import datetime
+import json
+import math
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qs
+
+START = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_articles(count: int) -> List[Dict]:
+    articles = []
+    for n in range(1, count + 1):
+        published = START + datetime.timedelta(hours=6 * n)
+        articles.append({
+            "cms_id": n,
+            "channelnameraw": "Pharmazie Tara Medizin" if n % 3 else "Politik Recht Wirtschaft",
+            "title": f"Artikel <i>{n}</i>",
+            "subtitle": f"Untertitel {n}",
+            "teasertext": f"<p>Teaser zu Artikel {n}</p>",
+            "pagecontent": "".join(f"<p>Absatz {p} von Artikel {n}, <b>Wirkstoff</b> und Indikation.</p>"
+                                   for p in range(12)),
+            "tags": ["Pharmazie", f"tag{n % 20}"],
+            "authorjson": {"firstname": "Erika", "lastname": f"Muster{n % 7}", "path": f"/autor/{n % 7}"},
+            "publishtimestamp": published.isoformat(),
+            "createdate": published.isoformat(),
+            "modified": published.isoformat(),
+            "url": f"https://www.oeaz.at/artikel/{n}",
+        })
+    return articles
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    articles: List[Dict] = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/articles":
+            self.send_error(404)
+            return
+        params = parse_qs(url.query)
+        page = int(params.get("page", ["1"])[0])
+        per_page = int(params.get("perPage", ["100"])[0])
+        since = datetime.datetime.fromisoformat(params["since"][0]) if "since" in params else None
+        articles = [a for a in self.articles
+                    if since is None or datetime.datetime.fromisoformat(a["modified"]) > since]
+
+        if "If-Modified-Since" in self.headers and not articles:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps({
+            "data": articles[(page - 1) * per_page:page * per_page],
+            "_metainfo": {"currentPage": page, "perPage": per_page, "totalCount": len(articles),
+                          "pageCount": max(1, math.ceil(len(articles) / per_page))}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=5000)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    FixtureHandler.articles = make_articles(args.articles)
+    print(f"serving {args.articles} articles on http://localhost:{args.port}/articles")
+    ThreadingHTTPServer(("", args.port), FixtureHandler).serve_forever()
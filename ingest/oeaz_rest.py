@@ -0,0 +1,143 @@
+"""
+fetches OEAZ online articles from the REST api and upserts them into oeaz_article:
+
+    python -m ingest.oeaz_rest [--api http://localhost:8765] [--full]
+
+pages are fetched concurrently over one pooled session, only articles changed since the last
+run are requested (since parameter + If-Modified-Since); the html transforms of from_rest_dict
+run in a process pool and results are written with OeazArticle.save_many
+"""
+import argparse
+import datetime
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import format_datetime
+from typing import Dict, List, Union
+
+import requests
+from lxml import html
+from requests.adapters import HTTPAdapter, Retry
+
+import settings
+from db.mongo import sync_state
+from helpers.page_cache import purge_pages
+from models.nav_tree import NavTree
+from models.oeaz_structured import OeazArticle
+
+logger = settings.logger
+
+PER_PAGE = 100
+FETCH_CONCURRENCY = 8
+TIMEOUT = 30
+WATERMARK_NAME = "oeaz_rest"
+
+HTML_FIELDS = ["title", "subtitle", "teasertext", "pagecontent"]
+DATE_FIELDS = ["publishtimestamp", "createdate"]
+
+
+def rest_dict_from_json(node: Dict) -> Dict:
+    """
+    the json article as from_rest_dict expects it: html fields as lists of strings and
+    lxml elements, timestamps as datetimes
+    """
+    in_dict = dict(node)
+    for field in HTML_FIELDS:
+        in_dict[field] = html.fragments_fromstring(node[field]) if node.get(field) else []
+    for field in DATE_FIELDS:
+        in_dict[field] = datetime.datetime.fromisoformat(node[field])
+    in_dict["tags"] = node.get("tags", [])
+    return in_dict
+
+
+def transform(node: Dict) -> Union[OeazArticle, None]:
+    # runs in the process pool: lxml parsing, template rendering, body pre-rendering
+    try:
+        return OeazArticle.from_rest_dict(rest_dict_from_json(node))
+    except Exception:
+        logger.exception(f"could not transform article {node.get('cms_id')}")
+        return None
+
+
+def make_session(pool_size: int = FETCH_CONCURRENCY) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                          max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[429, 502, 503, 504]))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_page(session: requests.Session, api: str, page: int, since: Union[datetime.datetime, None]) -> Union[Dict, None]:
+    params = {"page": page, "perPage": PER_PAGE}
+    headers = {}
+    if since is not None:
+        params["since"] = since.isoformat()
+        headers["If-Modified-Since"] = format_datetime(since, usegmt=True)
+    response = session.get(f"{api}/articles", params=params, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def ingest_oeaz_rest(api: str = settings.OEAZ_ONLINE_API, full: bool = False, workers: int = os.cpu_count(),
+                     fetch_concurrency: int = FETCH_CONCURRENCY) -> int:
+    started = datetime.datetime.now(datetime.timezone.utc)
+    state = sync_state.find_one({"name": WATERMARK_NAME})
+    # pymongo returns the stored UTC watermark as a naive datetime
+    since = None if full or state is None else state["watermark"].replace(tzinfo=datetime.timezone.utc)
+    session = make_session(fetch_concurrency)
+
+    timer = time.perf_counter()
+    first = fetch_page(session, api, 1, since)
+    if first is None:
+        logger.info(f"no articles changed since {since}")
+        return 0
+    page_count = first["_metainfo"]["pageCount"]
+    fetched = saved = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as transformers, \
+            ThreadPoolExecutor(max_workers=fetch_concurrency) as fetchers:
+        def _process(nodes: List[Dict]):
+            nonlocal fetched, saved
+            fetched += len(nodes)
+            articles = [a for a in transformers.map(transform, nodes, chunksize=max(1, len(nodes) // workers)) if a]
+            saved += OeazArticle.save_many(articles).operations
+
+        _process(first["data"])
+        # at most 2 * fetch_concurrency pages are fetched ahead of the transforms
+        remaining = iter(range(2, page_count + 1))
+        pending = {fetchers.submit(fetch_page, session, api, page, since)
+                   for page in itertools.islice(remaining, fetch_concurrency * 2)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result is not None:
+                    _process(result["data"])
+                page = next(remaining, None)
+                if page is not None:
+                    pending.add(fetchers.submit(fetch_page, session, api, page, since))
+
+    sync_state.update_one({"name": WATERMARK_NAME}, {"$set": {"watermark": started}}, upsert=True)
+    if saved:
+        # once per run, not per page: every purge empties the page cache of all processes
+        NavTree.mark_stale("oeaz")
+        NavTree.rebuild_stale()
+        purge_pages()
+    seconds = time.perf_counter() - timer
+    print(f"ingested {fetched} articles ({saved} saved) from {page_count} pages in {seconds:.1f}s, "
+          f"{fetched / seconds if seconds else 0:.0f} articles/s")
+    return saved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default=settings.OEAZ_ONLINE_API)
+    parser.add_argument("--full", action="store_true", help="ignore the watermark and fetch everything")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--fetch-concurrency", type=int, default=FETCH_CONCURRENCY)
+    args = parser.parse_args()
+    ingest_oeaz_rest(api=args.api, full=args.full, workers=args.workers, fetch_concurrency=args.fetch_concurrency)
@@ -0,0 +1,134 @@
+"""
+streams a SIS master data dump into the sis collection:
+
+    python -m ingest.sis_import sis_dump.json --indications sis_indications.json
+
+records are parsed incrementally (ijson), converted with SISMeta.from_sis_dict in a process pool
+and written with SISMeta.save_many; progress is checkpointed per chunk so an interrupted import
+resumes where it stopped (--restart ignores the checkpoint)
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from pathlib import Path
+from typing import Dict, List, Union
+
+import ijson
+
+import settings
+from db.mongo import sync_state
+from helpers.group import chunked
+from models.sis import SISMeta, Indication
+
+logger = settings.logger
+
+CHUNK_SIZE = 500
+IDENTITY_BLOCK = 64 * 1024
+
+_indication_dict: Union[Dict[str, Indication], None] = None
+
+
+def _init_worker(indications_path: str) -> None:
+    global _indication_dict
+    with open(indications_path) as f:
+        _indication_dict = Indication.from_sis_dict_list(json.load(f))
+
+
+def _convert(records: List[Dict]) -> List[SISMeta]:
+    result = []
+    for record in records:
+        try:
+            meta = SISMeta.from_sis_dict(record, indication_dict=_indication_dict)
+        except Exception:
+            logger.exception(f"could not convert {record.get('ZLNUMM')}")
+            continue
+        if meta is not None:
+            result.append(meta)
+    return result
+
+
+def _checkpoint_name(dump_path: Path) -> str:
+    return f"sis_import:{dump_path.name}"
+
+
+def dump_identity(dump_path: Path) -> str:
+    # size, mtime and the first block: a new dump under the same name does not resume an old checkpoint
+    stat = dump_path.stat()
+    with open(dump_path, "rb") as f:
+        head = hashlib.sha256(f.read(IDENTITY_BLOCK)).hexdigest()
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{head}"
+
+
+def get_checkpoint(dump_path: Path, identity: str) -> int:
+    state = sync_state.find_one({"name": _checkpoint_name(dump_path)})
+    if state is None: return 0
+    if state.get("identity") != identity:
+        logger.warning(f"{dump_path.name} changed since its checkpoint, importing it from the start")
+        return 0
+    return state["done"]
+
+
+def set_checkpoint(dump_path: Path, done: int, identity: str) -> None:
+    sync_state.update_one({"name": _checkpoint_name(dump_path)},
+                          {"$set": {"done": done, "identity": identity}}, upsert=True)
+
+
+def clear_checkpoint(dump_path: Path) -> None:
+    sync_state.delete_one({"name": _checkpoint_name(dump_path)})
+
+
+def import_sis(dump_path: Path, indications_path: Path, prefix: str = "item", workers: int = os.cpu_count(),
+               chunk_size: int = CHUNK_SIZE, restart: bool = False) -> int:
+    identity = dump_identity(dump_path)
+    done = 0 if restart else get_checkpoint(dump_path, identity)
+    if done:
+        logger.info(f"resuming {dump_path.name} after {done} records")
+    started = time.perf_counter()
+    read = saved = 0
+    with open(dump_path, "rb") as f, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(str(indications_path),)) as pool:
+        records = ijson.items(f, prefix, use_float=True)
+        for _ in zip(range(done), records): pass # skip what the checkpoint covers
+        # results are written in submission order, so the checkpoint always marks a contiguous prefix
+        window: deque[tuple[Future, int]] = deque()
+
+        def _write_oldest():
+            nonlocal done, saved
+            future, size = window.popleft()
+            models = future.result()
+            SISMeta.save_many(models, batch_size=chunk_size)
+            done += size
+            saved += len(models)
+            set_checkpoint(dump_path, done, identity)
+
+        for chunk in chunked(records, chunk_size):
+            window.append((pool.submit(_convert, chunk), len(chunk)))
+            read += len(chunk)
+            if len(window) >= workers * 2:
+                _write_oldest()
+        while window:
+            _write_oldest()
+    # a finished import starts from the beginning when run again
+    clear_checkpoint(dump_path)
+
+    seconds = time.perf_counter() - started
+    print(f"imported {read} records ({saved} saved) in {seconds:.1f}s, {read / seconds if seconds else 0:.0f} records/s")
+    return saved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dump", type=Path, help="SIS json dump")
+    parser.add_argument("--indications", type=Path, required=True, help="json list of SIS indication records")
+    parser.add_argument("--prefix", default="item", help="ijson prefix of the records in the dump")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint")
+    args = parser.parse_args()
+    import_sis(args.dump, args.indications, prefix=args.prefix, workers=args.workers,
+               chunk_size=args.chunk_size, restart=args.restart)
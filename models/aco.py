@@ -1,11 +1,15 @@
-from typing import Union, Any, Dict, List, Tuple, Generator
+import datetime
+from typing import Union, Any, Dict, List, Tuple, Generator, Iterable
 
 from pydantic import BaseModel
 from pymongo import UpdateOne
 from pymongo.errors import DuplicateKeyError
 
 import settings
+from db.bulk import bulk_write_batches, BulkWriteReport, BATCH_SIZE
+from db.keyset import keyset_page, KeysetPage, PAGE_SIZE
 from db.mongo import sis, LongSessionCursor, aco
+from helpers.normalize import sort_key, prefix_range
 from models.sis import SISMeta
 
 logger = settings.logger
@@ -26,12 +30,20 @@ class ACOGPTMeta(BaseModel):
     dosage: Union[str, None] = None
     dosage_form: Union[str, None] = None
 
+class ACOListEntry(BaseModel):
+    """
+    list row of an aco, read with a projection and built without validation
+    """
+    id:int
+    bezeichnung:str
+
 class ACOMeta(SISMeta):
     wirkstoffe: List[ACOActive]
     kurztexte: List[ACOKurztext]
     packungen:List[ACOPackage]
     meta:Union[ACOGPTMeta, None] = None
     processed:int=0
+    bez_key:Union[str, None] = None # sort_key(bezeichnung), for indexed prefix browsing
 
     @staticmethod
     def from_sismeta_and_aco_entries(sis_meta:SISMeta, aco_entry:Dict):
@@ -81,11 +93,13 @@ class ACOMeta(SISMeta):
         return ACOMeta(**entry)
 
     @staticmethod
-    def get_dicts_by_query(query: Dict) -> Generator:
-        lsc = LongSessionCursor(aco, query)
+    def get_dicts_by_query(query: Dict, projection: Union[Dict, None] = None, batch_size: int = 0) -> Generator:
+        lsc = LongSessionCursor(aco, query, projection=projection, batch_size=batch_size)
         return lsc.iter()
 
     def save(self) -> 'ACOMeta':
+        self.updated_at = datetime.datetime.now(datetime.timezone.utc)
+        self.bez_key = sort_key(self.bezeichnung)
         try:
              aco.insert_one(self.dict())
         except DuplicateKeyError as e:
@@ -94,20 +108,41 @@ class ACOMeta(SISMeta):
              aco.update_one(query, newvalues)
         except Exception as eg:
              logger.exception("Something wrong with the save")
+        # the nav tree and cached pages follow via search.sync, not per document
         return self
 
+    def upsert_operation(self) -> UpdateOne:
+        self.bez_key = sort_key(self.bezeichnung)
+        return super().upsert_operation()
+
+    @staticmethod
+    def save_many(models: Iterable['ACOMeta'], batch_size: int = BATCH_SIZE) -> BulkWriteReport:
+        # the caller marks the tree stale and purges pages once its run is done (or search.sync does)
+        return bulk_write_batches(aco, (m.upsert_operation() for m in models), batch_size=batch_size, label="aco save_many")
+
     @staticmethod
-    def get_by_bez_start(bez_start: str):
-        return [ACOMeta(**item) for item in
-                ACOMeta.get_dicts_by_query({"bezeichnung": {'$regex': f'^{bez_start}.*', '$options': 'i'}})]
+    def get_by_bez_start(bez_start: str, page_token: Union[str, None] = None, page_size: int = PAGE_SIZE) -> KeysetPage:
+        # range scan on the (bez_key, id) index, only the fields index_aco.html renders
+        return keyset_page(aco,
+                           query={"bez_key": prefix_range(sort_key(bez_start))},
+                           sort_field="bez_key",
+                           key_type=str,
+                           projection={"_id": 0, "id": 1, "bezeichnung": 1},
+                           build=lambda item: ACOListEntry.model_construct(**item),
+                           token=page_token,
+                           page_size=page_size)
 
     @staticmethod
     def get_name_groups(substring_len: int) -> list[Any]:
+        # grouped on the folded bez_key like the listing ("ASP"/"Asp", "Ärz"/"Arz" are one node),
+        # text is the prefix of a representative bezeichnung
         return list(aco.aggregate([
-            {"$sort": {"bezeichnung": 1}},
+            {"$match": {"bez_key": {"$type": "string"}}},
+            {"$sort": {"bez_key": 1, "bezeichnung": 1}},
             {"$group":
                 {
-                    "_id": {"$substrCP": ['$bezeichnung', 0, 3], },
+                    "_id": {"$substrCP": ['$bez_key', 0, 3], },
+                    "text": {"$first": {"$substrCP": ['$bezeichnung', 0, 3]}},
                 }
             },
             {"$sort": {"_id": 1}},
@@ -125,30 +160,28 @@ class ACOMeta(SISMeta):
             groups[entry["_id"][:1]].append(entry)
         for k, v in groups.items():
             abc_node = {
-                "text": k,
+                "text": k.upper(),
                 "icon": "fa fa-inbox fa-fw",
                 "nodes": []
             }
             tree_list.append(abc_node)
             for entry in v:
                 p_node = {
-                    "text": entry["_id"],
+                    "text": entry["text"],
                     "icon": "fa fa-inbox fa-fw",
                     "class": "text-info",
-                    "href": f"/aco/{entry['_id']}/"
+                    "href": f"/aco/{entry['text']}/"
                 }
                 abc_node["nodes"].append(p_node)
 
         return tree_list
 
     @staticmethod
-    def set_all_atrade():
-        operations = []
-        for a in ACOMeta.get_dicts_by_query({}):
-            operations.append(
-                UpdateOne({"_id": a["_id"]}, {'$set': {'i_trade': False}})
-            )
-        aco.bulk_write(operations)
+    def set_all_atrade(batch_size: int = BATCH_SIZE) -> BulkWriteReport:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        operations = (UpdateOne({"_id": a["_id"]}, {'$set': {'i_trade': False, 'updated_at': now}})
+                      for a in ACOMeta.get_dicts_by_query({}, projection={"_id": 1}, batch_size=batch_size))
+        return bulk_write_batches(aco, operations, batch_size=batch_size, label="set_all_atrade")
 
     def add_gpt_meta(self, gpt_meta:Dict):
         meta = ACOGPTMeta(**{
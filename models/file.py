@@ -1,36 +1,93 @@
-from typing import Dict, Union
+import hashlib
+import io
+import tempfile
+from typing import Dict, Union, BinaryIO
 
 from bson import ObjectId
+from gridfs import GridOut
+from gridfs.errors import FileExists
+from PIL import Image
 from pydantic import BaseModel
 from pydantic_mongo import PydanticObjectId
 
 import settings
-from db.mongo import fs
+from db.mongo import fs, fs_files, file_refs
+from helpers.cache import ByteLRUCache
 logger = settings.logger
 
+
+class ImageVariant(BaseModel):
+    width: int
+    format: str
+    mimetype: str
+    quality: int
+
+
+# names are part of the cached urls: change the name when changing a variant
+VARIANTS: Dict[str, ImageVariant] = {
+    "w200": ImageVariant(width=200, format="WEBP", mimetype="image/webp", quality=80),
+    "w400": ImageVariant(width=400, format="WEBP", mimetype="image/webp", quality=80),
+}
+
+READ_CHUNK = 255 * 1024 # gridfs chunk size
+SPOOL_MAX_MEMORY = 16 * 1024 * 1024 # uploads beyond this are spooled to a temp file while hashing
+
+
 class ACOFile(BaseModel):
     id:str
     mimetype:str
     source:bytes
 
     def save(self) -> PydanticObjectId:
-        try:
-            _id =fs.put(self.source, id=self.id, mimetype=self.mimetype)
-        except Exception as e:
-            logger.info(f"existing file {self.id} do nothing")
-            existing = ACOFile.get_objid(self.id)
-            try:
-                assert(existing != None)
-            except AssertionError as ae:
-                logger.exception(f"failed writing: {self.id} it is too big (probably)")
+        return ACOFile.save_stream(self.id, self.mimetype, io.BytesIO(self.source))
+
+    @staticmethod
+    def save_stream(id: str, mimetype: str, stream: BinaryIO) -> Union[PydanticObjectId, None]:
+        """
+        stores stream under id unless id exists; content that is already stored (same sha256)
+        is not uploaded again, id becomes a reference (file_refs) to the stored blob
+        """
+        existing = ACOFile.get_objid(id)
+        if existing is not None:
+            logger.info(f"existing file {id} do nothing")
             return existing
+        digest = hashlib.sha256()
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) as spool:
+            while chunk := stream.read(READ_CHUNK):
+                digest.update(chunk)
+                spool.write(chunk)
+            sha256 = digest.hexdigest()
+            blob = fs_files.find_one({"sha256": sha256}, {"_id": 1})
+            if blob is not None:
+                logger.info(f"file {id} is a duplicate of {blob['_id']}, storing a reference")
+                file_refs.update_one({"id": id},
+                                     {"$setOnInsert": {"mimetype": mimetype, "blob_id": blob["_id"], "sha256": sha256}},
+                                     upsert=True)
+                return PydanticObjectId(blob["_id"])
+            spool.seek(0)
+            try:
+                _id = fs.put(spool, id=id, mimetype=mimetype, sha256=sha256)
+            except Exception as e:
+                existing = ACOFile.get_objid(id)
+                if existing is None:
+                    logger.exception(f"failed writing: {id} it is too big (probably)")
+                return existing
+        if mimetype.startswith("image/"):
+            ACOFileVariant.create_all(_id)
         return _id
 
     @staticmethod
     def get_objid(id: str) -> Union[PydanticObjectId, None]:
-        im = fs.find_one({"id": id})
-        if im is None: return None
-        return PydanticObjectId(im._id)
+        im = fs_files.find_one({"id": id}, {"_id": 1})
+        if im is not None: return PydanticObjectId(im["_id"])
+        ref = file_refs.find_one({"id": id})
+        if ref is None: return None
+        return PydanticObjectId(ref["blob_id"])
+
+    @staticmethod
+    def open_by_objid(id: PydanticObjectId) -> Union[GridOut, None]:
+        # metadata only, chunks are read when the returned file is read
+        return fs.find_one({"_id": id})
 
     @staticmethod
     def get_by_objid(id: PydanticObjectId) -> Union['ACOFile', None]:
@@ -41,5 +98,83 @@ class ACOFile(BaseModel):
     @staticmethod
     def get(id:str) -> Union['ACOFile', None]:
         im = fs.find_one({"id": id})
+        if im is not None:
+            return ACOFile(id=im._file["id"], mimetype=im._file["mimetype"], source=im.read())
+        ref = file_refs.find_one({"id": id})
+        if ref is None: return None
+        im = fs.find_one({"_id": ref["blob_id"]})
         if im is None: return None
-        return ACOFile(id=im._file["id"], mimetype=im._file["mimetype"], source=im.read())
+        return ACOFile(id=id, mimetype=ref["mimetype"], source=im.read())
+
+
+class ACOFileVariant:
+    """
+    resized/recompressed copies of an image, stored in gridfs next to the original
+    and found by (source_id, variant)
+    """
+    @staticmethod
+    def render(source: bytes, variant: ImageVariant) -> bytes:
+        with Image.open(io.BytesIO(source)) as im:
+            if im.width > variant.width:
+                im = im.resize((variant.width, max(1, round(im.height * variant.width / im.width))), Image.LANCZOS)
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+            out = io.BytesIO()
+            im.save(out, format=variant.format, quality=variant.quality)
+            return out.getvalue()
+
+    @staticmethod
+    def open(source_id: PydanticObjectId, name: str) -> Union[GridOut, None]:
+        return fs.find_one({"source_id": source_id, "variant": name})
+
+    @staticmethod
+    def get_or_create(source_id: PydanticObjectId, name: str) -> Union[GridOut, None]:
+        existing = ACOFileVariant.open(source_id, name)
+        if existing is not None: return existing
+        source = fs.find_one({"_id": source_id})
+        if source is None: return None
+        variant = VARIANTS[name]
+        try:
+            data = ACOFileVariant.render(source.read(), variant)
+        except Exception:
+            logger.exception(f"could not render {name} of {source_id}")
+            return None
+        _id = ObjectId()
+        try:
+            fs.put(data, _id=_id, id=f"{source._file['id']}@{name}", source_id=source_id, variant=name,
+                   mimetype=variant.mimetype)
+        except FileExists:
+            # created concurrently (gridfs reports the duplicate fs.files key as FileExists),
+            # drop our chunks and use the other one
+            fs.delete(_id)
+        return ACOFileVariant.open(source_id, name)
+
+    @staticmethod
+    def create_all(source_id: PydanticObjectId) -> None:
+        for name in VARIANTS:
+            ACOFileVariant.get_or_create(source_id, name)
+
+
+FILE_CACHE_BYTES = 256 * 1024 * 1024
+FILE_CACHE_MAX_FILE = 8 * 1024 * 1024 # bigger files are streamed, not cached
+
+
+class ACOFileLoader:
+    """
+    keeps files up to max_file_bytes in an LRU cache bounded by max_bytes
+    """
+    def __init__(self, max_bytes: int = FILE_CACHE_BYTES, max_file_bytes: int = FILE_CACHE_MAX_FILE):
+        self.cache = ByteLRUCache(max_bytes)
+        self.max_file_bytes = max_file_bytes
+
+    def cacheable(self, length: int) -> bool:
+        return length <= self.max_file_bytes
+
+    def load(self, grid_out: GridOut, key: str) -> ACOFile:
+        file = ACOFile(id=grid_out._file["id"], mimetype=grid_out._file["mimetype"], source=grid_out.read())
+        if self.cacheable(len(file.source)):
+            self.cache.put(key, file, len(file.source))
+        return file
+
+
+file_loader = ACOFileLoader()
@@ -0,0 +1,89 @@
+import datetime
+import threading
+import time
+from typing import List, Dict, Callable, Union, Tuple
+
+from pydantic import BaseModel
+
+import settings
+from db.mongo import nav_trees
+from helpers.page_cache import content_version
+
+logger = settings.logger
+
+VERSION_CHECK = 30 # seconds a process serves its in-memory tree before checking the stored version
+
+_memory: Dict[str, Tuple[float, int, List, int]] = {} # name -> (checked, version, tree, content version)
+_lock = threading.Lock()
+
+
+def _builders() -> Dict[str, Callable[[], List]]:
+    # imported here, the models import NavTree to mark their trees stale
+    from models.aco import ACOMeta
+    from models.oeaz_structured import OeazArticle
+    return {
+        "aco": ACOMeta.get_by_name_groups,
+        "oeaz": OeazArticle.get_pubyear_tree,
+    }
+
+
+class NavTree(BaseModel):
+    """
+    left hand navigation tree, built by aggregation off the request path and stored in nav_trees
+    """
+    name: str
+    version: int = 0
+    stale: bool = True
+    built: Union[datetime.datetime, None] = None
+    tree: List = []
+
+    @staticmethod
+    def mark_stale(name: str) -> None:
+        # stale_count lets a rebuild tell whether it was marked stale again while aggregating
+        nav_trees.update_one({"name": name}, {"$set": {"stale": True}, "$inc": {"stale_count": 1}}, upsert=True)
+
+    @staticmethod
+    def rebuild(name: str) -> 'NavTree':
+        started = time.perf_counter()
+        seen = (nav_trees.find_one({"name": name}, {"stale_count": 1}) or {}).get("stale_count")
+        tree = _builders()[name]()
+        update = {"$set": {"tree": tree, "built": datetime.datetime.now()}, "$inc": {"version": 1}}
+        entry = nav_trees.find_one_and_update(
+            {"name": name, "stale_count": seen},
+            {**update, "$set": {**update["$set"], "stale": False}},
+            return_document=True
+        )
+        if entry is None:
+            # marked stale again since the aggregation started (or first build): the flag stays
+            entry = nav_trees.find_one_and_update({"name": name}, update, upsert=True, return_document=True)
+        logger.info(f"rebuilt {name} tree in {time.perf_counter() - started:.2f}s")
+        return NavTree(**entry)
+
+    @staticmethod
+    def rebuild_stale() -> None:
+        stale = {e["name"] for e in nav_trees.find({"stale": True}, {"name": 1})}
+        for name in _builders():
+            if name in stale or nav_trees.count_documents({"name": name}, limit=1) == 0:
+                NavTree.rebuild(name)
+
+    @staticmethod
+    def get_tree(name: str) -> List:
+        now = time.monotonic()
+        cached = _memory.get(name)
+        # a purge of the page cache forces a check, pages cached under the new version need the new tree
+        pages = content_version()
+        if cached and now - cached[0] < VERSION_CHECK and cached[3] == pages:
+            return cached[2]
+
+        # a stale tree is still served, rebuild_stale (sync, ingest, reindex) replaces it off the request path
+        stamp = nav_trees.find_one({"name": name, "version": {"$gt": 0}}, {"version": 1})
+        if stamp is None:
+            # nothing built yet (fresh database)
+            entry = NavTree.rebuild(name)
+        elif cached and cached[1] == stamp["version"]:
+            entry = NavTree.model_construct(name=name, version=cached[1], tree=cached[2])
+        else:
+            entry = NavTree(**nav_trees.find_one({"name": name}))
+        with _lock:
+            _memory[name] = (now, entry.version, entry.tree, pages)
+        return entry.tree
@@ -1,19 +1,23 @@
 import collections
 import datetime
+import functools
 import json
 import re
 from pathlib import Path
 from string import Template
-from typing import List, Union, Generator, Dict, Literal, Optional, Any
+from typing import List, Union, Generator, Dict, Literal, Optional, Any, Iterable
 
 from lxml import etree, html
 import html as html_
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from pydantic_mongo import PydanticObjectId
+from pymongo import UpdateOne
 from pymongo.errors import DuplicateKeyError
 
 import settings
-from db.mongo import oeaz_structured, LongSessionCursor, oeaz_article
+from db.bulk import bulk_write_batches, BulkWriteReport, BATCH_SIZE
+from db.keyset import keyset_page, KeysetPage, PAGE_SIZE
+from db.mongo import oeaz_structured, LongSessionCursor, oeaz_article, tombstones
 from helpers.ws import replaceWS
 from models.file import ACOFile
 
@@ -108,8 +112,8 @@ class OeazStructuredIssue(BaseModel):
         return OeazStructuredIssue(**issue)
 
     @staticmethod
-    def get_dicts_by_query(query: Dict) -> Generator:
-        lsc = LongSessionCursor(oeaz_structured, query)
+    def get_dicts_by_query(query: Dict, projection: Union[Dict, None] = None, batch_size: int = 0) -> Generator:
+        lsc = LongSessionCursor(oeaz_structured, query, projection=projection, batch_size=batch_size)
         return lsc.iter()
 
 
@@ -160,6 +164,54 @@ class OeazMeta(BaseModel):
     keywords: List[OeazKeyword] = []
 
 
+@functools.lru_cache(maxsize=1)
+def article_template() -> Template:
+    # read once per process instead of once per article
+    templatepath = settings.BASEPATH.joinpath("assets", "templates", "article_template.html")
+    with open(templatepath, "r") as f:
+        return Template(f.read())
+
+
+HTML_BODY_VERSION = 1 # bump when render_html_body changes, then run ingest.backfill_html_body
+
+
+def render_html_body(html_raw: str) -> List[str]:
+    # serialized top level nodes of <body>, what detail_oeaz.html renders
+    if not html_raw: return []
+    return [etree.tounicode(node) for node in html.fromstring(html_raw).xpath("//body/*")]
+
+
+class OeazArticleSummary(BaseModel):
+    """
+    list row of an article, read with a projection and built without validation
+    """
+    id: int
+    title: str
+    pubdate: datetime.datetime
+    rubrik: str
+
+    @staticmethod
+    def get_by_month_and_year_sorted(month:int, year:int, sort:int,
+                                     fields:tuple=("id", "title", "pubdate", "rubrik")) -> List['OeazArticleSummary']:
+        query = OeazArticle.month_range_query(month=int(month), year=int(year))
+        projection = {"_id": 0, **{f: 1 for f in fields}}
+        # (pubdate, id) order comes straight from the index, no in-memory sort
+        cursor = oeaz_article.find(query, projection).sort([("pubdate", sort), ("id", sort)])
+        return [OeazArticleSummary.model_construct(**item) for item in cursor]
+
+    @staticmethod
+    def get_page_by_month_and_year(month:int, year:int, page_token:Union[str, None]=None,
+                                   page_size:int=PAGE_SIZE) -> KeysetPage:
+        return keyset_page(oeaz_article,
+                           query=OeazArticle.month_range_query(month=int(month), year=int(year)),
+                           sort_field="pubdate",
+                           key_type=datetime.datetime,
+                           projection={"_id": 0, "id": 1, "title": 1, "pubdate": 1, "rubrik": 1},
+                           build=lambda item: OeazArticleSummary.model_construct(**item),
+                           token=page_token,
+                           page_size=page_size)
+
+
 class OeazArticle(BaseModel):
     id: int
     nummer: int
@@ -179,8 +231,26 @@ class OeazArticle(BaseModel):
     source: int=0 # 0 = oeaz_oline, 1 = archive
     meta: Union[OeazMeta, None] = None
     processed: int = 0
+    updated_at: Union[datetime.datetime, None] = None
+    html_body: List[str] = [] # rendered from html_raw when saved
+    html_body_version: int = 0
+    _body_source: Union[str, None] = PrivateAttr(None) # html_raw the current html_body was rendered from
+
+    def render_body(self) -> 'OeazArticle':
+        self.html_body = render_html_body(self.html_raw)
+        self.html_body_version = HTML_BODY_VERSION
+        self._body_source = self.html_raw
+        return self
+
+    def ensure_body(self) -> 'OeazArticle':
+        # bodies rendered before (e.g. in the ingest process pool) are not rendered again
+        if self.html_body_version != HTML_BODY_VERSION or self._body_source != self.html_raw:
+            self.render_body()
+        return self
 
     def save(self) -> 'OeazArticle':
+        self.updated_at = datetime.datetime.now(datetime.timezone.utc)
+        self.ensure_body()
         try:
             oeaz_article.insert_one(self.dict())
         except DuplicateKeyError as e:
@@ -189,26 +259,54 @@ class OeazArticle(BaseModel):
             oeaz_article.update_one(query, newvalues)
         except Exception as eg:
             logger.exception("Something wrong with the save")
+        # single saves reach the nav tree and cached pages through search.sync
         return self
 
+    def upsert_operation(self) -> UpdateOne:
+        self.updated_at = datetime.datetime.now(datetime.timezone.utc)
+        self.ensure_body()
+        return UpdateOne({"id": self.id}, {"$set": self.dict()}, upsert=True)
+
+    @staticmethod
+    def save_many(models: Iterable['OeazArticle'], batch_size: int = BATCH_SIZE) -> BulkWriteReport:
+        # the caller marks the tree stale and purges pages once its run is done (or search.sync does)
+        return bulk_write_batches(oeaz_article, (m.upsert_operation() for m in models), batch_size=batch_size,
+                                  label="oeaz_article save_many")
+
     @staticmethod
-    def get(id: int) -> Union['OeazArticle', None]:
-        art = oeaz_article.find_one({"id": id})
+    def get(id: int, projection: Union[Dict, None] = None) -> Union['OeazArticle', None]:
+        art = oeaz_article.find_one({"id": id}, projection)
         if art is None: return None
         return OeazArticle(**art)
 
     @staticmethod
-    def get_dicts_by_query(query: Dict) -> Generator:
-        lsc = LongSessionCursor(oeaz_article, query)
+    def get_for_display(id: int) -> Union['OeazArticle', None]:
+        # html_raw is only needed (and loaded) when the stored body is missing or outdated
+        article = OeazArticle.get(id, projection={"html_raw": 0})
+        if article is None or article.html_body_version == HTML_BODY_VERSION: return article
+        logger.warning(f"rendering outdated html body of {id}, run ingest.backfill_html_body")
+        return OeazArticle.get(id).render_body()
+
+    @staticmethod
+    def get_many(ids: List[int], projection: Union[Dict, None] = None) -> Dict[int, 'OeazArticle']:
+        if not ids: return {}
+        return {art["id"]: OeazArticle(**art) for art in oeaz_article.find({"id": {"$in": ids}}, projection)}
+
+    @staticmethod
+    def get_dicts_by_query(query: Dict, projection: Union[Dict, None] = None, batch_size: int = 0) -> Generator:
+        lsc = LongSessionCursor(oeaz_article, query, projection=projection, batch_size=batch_size)
         return lsc.iter()
 
     @staticmethod
-    def get_paginated(skip:int, limit:int):
-        return [OeazArticle(**item) for item in oeaz_article.find().sort("pubdate", 1).skip(skip).limit(limit)]
+    def get_paginated(page_token:Union[str, None]=None, limit:int=PAGE_SIZE) -> KeysetPage:
+        return keyset_page(oeaz_article, query={}, sort_field="pubdate", key_type=datetime.datetime, projection={},
+                           build=lambda item: OeazArticle(**item), token=page_token, page_size=limit)
 
     @staticmethod
     def delete(id: int) -> None:
         oeaz_article.delete_one({"id": id})
+        # lets the incremental search sync remove the article from the index
+        tombstones.insert_one({"collection": oeaz_article.name, "id": id, "updated_at": datetime.datetime.now(datetime.timezone.utc)})
 
     @staticmethod
     def count():
@@ -218,9 +316,7 @@ class OeazArticle(BaseModel):
     @staticmethod
     def from_rest_dict(in_dict) -> 'OeazArticle':
         #content
-        templatepath = settings.BASEPATH.joinpath("assets", "templates", "article_template.html")
-        with open(templatepath, "r") as f:
-            template = Template(f.read())
+        template = article_template()
         try:
             title = " ".join([i if isinstance(i, str) else etree.tounicode(i) for i in in_dict["title"]])
             subtitle =" ".join([i if isinstance(i, str) else etree.tounicode(i) for i in in_dict["subtitle"]])
@@ -285,7 +381,7 @@ class OeazArticle(BaseModel):
             url=in_dict["url"],
             author=author,
             teaser = teaser,
-        )
+        ).render_body()
 
     @staticmethod
     def get_month_and_year_dict() -> list[Any]:
@@ -340,7 +436,7 @@ class OeazArticle(BaseModel):
     @staticmethod
     def get_pubmonth_tree(year:int, month:int) -> List:
         tree_list = []
-        articles = OeazArticle.get_by_month_and_year_sorted(year=year, month=month, sort=1)
+        articles = OeazArticleSummary.get_by_month_and_year_sorted(year=year, month=month, sort=1, fields=("id", "title"))
         for article in articles:
             a_node = {
                 "text": article.title,
@@ -352,15 +448,17 @@ class OeazArticle(BaseModel):
 
         return tree_list
 
+    @staticmethod
+    def month_range_query(month:int, year:int) -> Dict:
+        # half open [first of month, first of next month) range, served by the (pubdate, id) index
+        start = datetime.datetime(year, month, 1)
+        end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+        return {"pubdate": {"$gte": start, "$lt": end}}
+
     @staticmethod
     def get_by_month_and_year_sorted(month:int, year:int, sort:int):
-        query = {
-            "$expr": {
-                "$and": [{"$eq": [{"$month": "$pubdate"}, month]},
-                         {"$eq": [{"$year": "$pubdate"}, year]}]
-            }
-        }
-        return [OeazArticle(**item) for item in oeaz_article.find(query).sort("id", sort)]
+        query = OeazArticle.month_range_query(month=int(month), year=int(year))
+        return [OeazArticle(**item) for item in oeaz_article.find(query).sort([("pubdate", sort), ("id", sort)])]
 
     def add_gpt_meta(self, gpt_meta:Dict):
         meta = OeazMeta(**{
@@ -1,9 +1,13 @@
-from typing import Union, List, Dict, Generator
+import datetime
+from pathlib import Path
+from typing import Union, List, Dict, Generator, Iterable
 
 from pydantic import BaseModel
+from pymongo import UpdateOne
 from pymongo.errors import DuplicateKeyError
 
 import settings
+from db.bulk import bulk_write_batches, BulkWriteReport, BATCH_SIZE
 from db.mongo import sis, LongSessionCursor
 
 logger = settings.logger
@@ -25,24 +29,88 @@ class Indication(BaseModel):
             parentCode= None if kwargs["IndicationParentCode"] == "" else kwargs["IndicationParentCode"]
         )
 
-    @staticmethod
-
-
     @staticmethod
     def from_sis_dict_list(data:List[Dict[str,Union[str,int,List[str]]]]) -> Dict[str,'Indication']:
         indication_dict:Dict[str,Indication] = {d["IndicationCode"]:Indication.from_sis_dict(**d)  for d in data}
-        idx = 1
-        for value in indication_dict.values():
-            #logger.info(idx)
-            idx += 1
-            node:Indication = value
-            for k, v in indication_dict.items():
-                if node.parentCode == k and not node == v:
-                    v.children.append(node)
+        # one dict lookup per node instead of scanning all nodes for the parent
+        for node in indication_dict.values():
+            parent = indication_dict.get(node.parentCode) if node.parentCode else None
+            if parent is not None and parent is not node:
+                parent.children.append(node)
 
         return indication_dict
 
 
+class IndicationIndex(BaseModel):
+    """
+    parent links, ancestor paths and euler tour intervals of the indication tree: the descendants
+    of a code are order[enter[code]:leave[code]], so "is x under y" is a range check
+    """
+    parent: Dict[str, Union[str, None]] = {}
+    ancestors: Dict[str, List[str]] = {} # root first, without the code itself
+    enter: Dict[str, int] = {}
+    leave: Dict[str, int] = {}
+    order: List[str] = []
+
+    @staticmethod
+    def from_indications(indication_dict: Dict[str, Indication]) -> 'IndicationIndex':
+        index = IndicationIndex()
+        children: Dict[str, List[str]] = {code: [] for code in indication_dict}
+        for code, node in indication_dict.items():
+            parent = node.parentCode if node.parentCode in indication_dict and node.parentCode != code else None
+            index.parent[code] = parent
+            if parent is not None:
+                children[parent].append(code)
+
+        # iterative dfs from the roots, then from whatever is left (parent cycles)
+        roots = [code for code, parent in index.parent.items() if parent is None]
+        for start in roots + list(indication_dict):
+            if start in index.enter: continue
+            index.ancestors[start] = []
+            stack = [(start, False)]
+            while stack:
+                code, done = stack.pop()
+                if done:
+                    index.leave[code] = len(index.order)
+                    continue
+                index.enter[code] = len(index.order)
+                index.order.append(code)
+                stack.append((code, True))
+                path = index.ancestors[code] + [code]
+                for child in reversed(children[code]):
+                    if child in index.enter: continue
+                    index.ancestors[child] = path
+                    stack.append((child, False))
+        return index
+
+    def parent_of(self, code: str) -> Union[str, None]:
+        return self.parent.get(code)
+
+    def ancestors_of(self, code: str) -> List[str]:
+        return self.ancestors.get(code, [])
+
+    def is_descendant(self, code: str, of: str, include_self: bool = True) -> bool:
+        if code not in self.enter or of not in self.enter: return False
+        if code == of: return include_self
+        return self.enter[of] <= self.enter[code] < self.leave[of]
+
+    def descendants_of(self, code: str, include_self: bool = True) -> List[str]:
+        if code not in self.enter: return []
+        start = self.enter[code] if include_self else self.enter[code] + 1
+        return self.order[start:self.leave[code]]
+
+    def covers(self, codes: List[str], of: str) -> bool:
+        # e.g. all products under indication X: index.covers([i.code for i in sis.indications], X)
+        return any(self.is_descendant(code, of) for code in codes)
+
+    def save(self, path: Path) -> None:
+        path.write_text(self.model_dump_json())
+
+    @staticmethod
+    def load(path: Path) -> 'IndicationIndex':
+        return IndicationIndex.model_validate_json(path.read_text())
+
+
 class SISMeta(BaseModel):
     id:int
     bezeichnung:str
@@ -59,6 +127,7 @@ class SISMeta(BaseModel):
     indications:List[Indication] = []
     pi:bool=False
     faulty:bool=False
+    updated_at:Union[datetime.datetime, None] = None
 
     @staticmethod
     def from_sis_dict(data:Dict, indication_dict=Dict[str,Indication], exclude_fringe=True) -> Union['SISMeta', None]:
@@ -109,11 +178,12 @@ class SISMeta(BaseModel):
         return SISMeta(**entry)
 
     @staticmethod
-    def get_dicts_by_query(query: Dict) -> Generator:
-        lsc = LongSessionCursor(sis, query)
+    def get_dicts_by_query(query: Dict, projection: Union[Dict, None] = None, batch_size: int = 0) -> Generator:
+        lsc = LongSessionCursor(sis, query, projection=projection, batch_size=batch_size)
         return lsc.iter()
 
     def save(self) -> 'SISMeta':
+        self.updated_at = datetime.datetime.now(datetime.timezone.utc)
         try:
              sis.insert_one(self.dict())
         except DuplicateKeyError as e:
@@ -124,3 +194,10 @@ class SISMeta(BaseModel):
              logger.exception("Something wrong with the save")
         return self
 
+    def upsert_operation(self) -> UpdateOne:
+        self.updated_at = datetime.datetime.now(datetime.timezone.utc)
+        return UpdateOne({"id": self.id}, {"$set": self.dict()}, upsert=True)
+
+    @staticmethod
+    def save_many(models: Iterable['SISMeta'], batch_size: int = BATCH_SIZE) -> BulkWriteReport:
+        return bulk_write_batches(sis, (m.upsert_operation() for m in models), batch_size=batch_size, label="sis save_many")
@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Iterable, Dict, List, Tuple
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import streaming_bulk
+from pydantic import BaseModel
+
+import settings
+from helpers.group import chunked
+
+logger = settings.logger
+
+CHUNK_SIZE = 1000
+MAX_CHUNK_BYTES = 10 * 1024 * 1024
+THREAD_COUNT = 4
+MAX_RETRIES = 3 # retries of items rejected with 429 (es queue full), with exponential backoff
+INITIAL_BACKOFF = 2
+
+
+class BulkReport(BaseModel):
+    label: str
+    indexed: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.indexed / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return f"{self.label}: indexed {self.indexed} docs in {self.seconds:.1f}s " \
+               f"({self.docs_per_sec:.0f} docs/s), {self.failed} failed"
+
+
+def _send_chunk(es: Elasticsearch, chunk: List[Dict], max_chunk_bytes: int, max_retries: int) -> Tuple[int, List[Dict]]:
+    indexed = 0
+    errors = []
+    try:
+        for ok, item in streaming_bulk(es, chunk,
+                                       chunk_size=len(chunk),
+                                       max_chunk_bytes=max_chunk_bytes,
+                                       max_retries=max_retries,
+                                       initial_backoff=INITIAL_BACKOFF,
+                                       raise_on_error=False,
+                                       raise_on_exception=False):
+            if ok: indexed += 1
+            else: errors.append(item)
+    except Exception as e:
+        logger.exception("bulk chunk failed")
+        errors.extend({"index": {"error": str(e)}} for _ in range(len(chunk) - indexed - len(errors)))
+    return indexed, errors
+
+
+def bulk_index(es: Elasticsearch,
+               actions: Iterable[Dict],
+               label: str = "bulk",
+               chunk_size: int = CHUNK_SIZE,
+               max_chunk_bytes: int = MAX_CHUNK_BYTES,
+               thread_count: int = THREAD_COUNT,
+               max_retries: int = MAX_RETRIES) -> BulkReport:
+    """
+    streams actions (dicts with _index/_id and the source fields) into es, holding at most
+    2 * thread_count chunks in memory; chunks are sent in parallel by thread_count workers.
+    """
+    report = BulkReport(label=label)
+    lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(thread_count * 2)
+
+    def _collect(fut: Future):
+        in_flight.release()
+        indexed, errors = fut.result()
+        with lock:
+            report.indexed += indexed
+            report.failed += len(errors)
+        for e in errors[:3]:
+            logger.warning(f"{label}: failed item {e}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=thread_count) as pool:
+        for chunk in chunked(actions, chunk_size):
+            in_flight.acquire()
+            pool.submit(_send_chunk, es, chunk, max_chunk_bytes, max_retries).add_done_callback(_collect)
+    report.seconds = time.perf_counter() - started
+    logger.info(str(report))
+    return report
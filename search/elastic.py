@@ -1,93 +1,131 @@
+import datetime
 import json
+import os
 import random
 import re
-from pprint import pprint
-from typing import Dict
+import threading
+from typing import Dict, Generator, Iterable, Union
 
 from elasticsearch import Elasticsearch
 
 import settings
+from helpers.cache import TTLCache
 from helpers.group import group_object
+from helpers.page_cache import purge_pages
 from models.aco import ACOMeta
+from models.nav_tree import NavTree
 from models.oeaz_structured import OeazArticle
+from search.bulk import bulk_index, BulkReport
+from search.generations import create_generation, drop_generations, publish, collect_garbage, active_generations
+from search.mappings import ACO_MAPPINGS, ACO_ACTIVES_MAPPINGS, OEAZ_PRODUCTS_MAPPINGS, \
+    OEAZ_SUBSTANCES_MAPPINGS, OEAZ_DISEASES_MAPPINGS
 
 logger = settings.logger
 
+TYPEAHEAD_SIZE = 15 # matches the typeahead limit in typeahead.html
+TYPEAHEAD_CACHE_SIZE = 10000
+TYPEAHEAD_CACHE_TTL = 300 # bounds staleness after incremental syncs, reindexes change the key
+GENERATION_TTL = 10
+
+# index names used below are aliases, the physical indices are generations (see search.generations)
+
 
 class Client:
     def __init__(self):
+        # no request here, the connection is opened on first use
         self.es = Elasticsearch(settings.ELASTIC)
+
+    def check(self) -> Dict:
         client_info = self.es.info()
-        print('Connected to Elasticsearch!')
-        pprint(client_info.body)
-
-def index_oeaz(_client: Client, query:Dict):
-    _client.es.indices.delete(index="oeaz_products", ignore_unavailable=True)
-    _client.es.indices.delete(index="oeaz_substances", ignore_unavailable=True)
-    _client.es.indices.delete(index="oeaz_diseases", ignore_unavailable=True)
-    _client.es.indices.create(index="oeaz_products", mappings={})  # todo:mappings!
-    _client.es.indices.create(index="oeaz_substances", mappings={})  # todo:mappings!
-    _client.es.indices.create(index="oeaz_diseases", mappings={})  # todo:mappings!
-    articles = [OeazArticle(**a) for a in OeazArticle.get_dicts_by_query(query)]
-    operations_products = []
-    operations_substances = []
-    operations_diseases = []
-    for idx, article in enumerate(articles):
-        logger.info(f"[{idx}/{len(articles)}] - checked")
-        prod = [{"id": article.id, "product": kw.name} for kw in article.meta.keywords if kw.type == "trade_name"]
-        subs = [{"id": article.id, "substance": kw.name} for kw in article.meta.keywords if kw.type == "substance"]
-        dis = [{"id": article.id, "disease": kw.name} for kw in article.meta.keywords if kw.type == "disease"]
-        for entry in prod:
-            operations_products.append({'index': {'_index': "oeaz_products"}})
-            operations_products.append(entry)
-        for entry in subs:
-            operations_substances.append({'index': {'_index': "oeaz_substances"}})
-            operations_substances.append(entry)
-        for entry in dis:
-            operations_diseases.append({'index': {'_index': "oeaz_diseases"}})
-            operations_diseases.append(entry)
-
-    if len(operations_products) >= 0:
-        _client.es.bulk(operations=operations_products)
-        operations_products.clear()
-    if len(operations_substances) >= 0:
-        _client.es.bulk(operations=operations_substances)
-        operations_substances.clear()
-    if len(operations_diseases) >= 0:
-        _client.es.bulk(operations=operations_diseases)
-        operations_substances.clear()
-
-def index_aco(_client: Client, query:Dict):
-    _client.es.indices.delete(index="aco", ignore_unavailable=True)
-    _client.es.indices.delete(index="aco_actives", ignore_unavailable=True)
-    _client.es.indices.create(index="aco", mappings={})  # todo:mappings!
-    _client.es.indices.create(index="aco_actives", mappings={})  # todo:mappings!
-    aco_dicts = list(ACOMeta.get_dicts_by_query(query))
-    operations_aco = []
-    operations_actives = []
-    for aco in aco_dicts:
-        aco = ACOMeta(**aco)
-
-        ws = [{"id": aco.id, "bezeichnung": v.bezeichnung} for v in aco.wirkstoffe]
-
-        for entry in ws:
-            operations_actives.append({'index': {'_index': "aco_actives"}})
-            operations_actives.append(entry)
-
-        try:
-            index_obj = {
-                "id": aco.id,
-                "bezeichnung": aco.bezeichnung,
-                "anwendung": " ".join([kt.text for kt in aco.kurztexte if kt.bezeichnung=='Anwendungsgebiete']),
-                "warn": " ".join([kt.text for kt in aco.kurztexte if kt.bezeichnung in ['Gegenanzeigen', 'Wechselwirkungen', 'Warnhinweise'] and kt.text is not None])
-            }
-        except:
-            print()
+        logger.info(f"Connected to Elasticsearch {client_info.body['version']['number']}")
+        return client_info.body
+
+
+_client: Union[Client, None] = None
+_client_pid: Union[int, None] = None
+_lock = threading.Lock()
+
+def get_client() -> Client:
+    """
+    process wide client, created on first use and again in forked workers
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = Client()
+                _client_pid = os.getpid()
+    return _client
+
+def init_app(app) -> None:
+    app.extensions["elastic"] = get_client
+
+def oeaz_actions(article:OeazArticle) -> Generator[Dict, None, None]:
+    if article.meta is None: return
+    for kw in article.meta.keywords:
+        if kw.type == "trade_name":
+            yield {"_index": "oeaz_products", "id": article.id, "product": kw.name, "title": article.title}
+        elif kw.type == "substance":
+            yield {"_index": "oeaz_substances", "id": article.id, "substance": kw.name, "title": article.title}
+        elif kw.type == "disease":
+            yield {"_index": "oeaz_diseases", "id": article.id, "disease": kw.name, "title": article.title}
+
+def aco_actions(aco:ACOMeta) -> Generator[Dict, None, None]:
+    yield {
+        "_index": "aco",
+        "_id": aco.id,
+        "id": aco.id,
+        "bezeichnung": aco.bezeichnung,
+        "anwendung": " ".join([kt.text for kt in aco.kurztexte if kt.bezeichnung=='Anwendungsgebiete' and kt.text is not None]),
+        "warn": " ".join([kt.text for kt in aco.kurztexte if kt.bezeichnung in ['Gegenanzeigen', 'Wechselwirkungen', 'Warnhinweise'] and kt.text is not None])
+    }
+    for v in aco.wirkstoffe:
+        yield {"_index": "aco_actives", "id": aco.id, "bezeichnung": v.bezeichnung}
 
-        operations_aco.append({'index': {'_index': "aco"}})
-        operations_aco.append(index_obj)
-    _client.es.bulk(operations=operations_aco)
-    _client.es.bulk(operations=operations_actives)
+ACO_QUERY = {"processed": 2}
+OEAZ_QUERY = {"rubrik": {"$regex": ".*Tara.*", '$options': 'i'}, "processed" : 2}
+
+ACO_INDICES = {
+    "aco": ACO_MAPPINGS,
+    "aco_actives": ACO_ACTIVES_MAPPINGS,
+}
+OEAZ_INDICES = {
+    "oeaz_products": OEAZ_PRODUCTS_MAPPINGS,
+    "oeaz_substances": OEAZ_SUBSTANCES_MAPPINGS,
+    "oeaz_diseases": OEAZ_DISEASES_MAPPINGS,
+}
+
+def _stream_actions(docs:Iterable[Dict], model, to_actions, targets:Dict[str,str], label:str) -> Generator[Dict, None, None]:
+    for idx, doc in enumerate(docs):
+        if idx and idx % 1000 == 0:
+            logger.info(f"{label}: [{idx}] - checked")
+        for action in to_actions(model(**doc)):
+            action["_index"] = targets[action["_index"]]
+            yield action
+
+def _rebuild(_client: Client, indices:Dict[str,Dict], docs:Iterable[Dict], model, to_actions, label:str) -> BulkReport:
+    """
+    loads a new generation of every alias in indices and swaps all of them at once when done;
+    a generation with failed documents is dropped and the aliases stay where they are
+    """
+    targets = {alias: create_generation(_client.es, alias, mappings) for alias, mappings in indices.items()}
+    try:
+        report = bulk_index(_client.es, _stream_actions(docs, model, to_actions, targets, label), label=label)
+        if report.failed:
+            raise RuntimeError(f"{label}: {report.failed} documents failed to index, new generation not published")
+    except Exception:
+        drop_generations(_client.es, list(targets.values()))
+        raise
+    publish(_client.es, targets)
+    for alias in targets:
+        collect_garbage(_client.es, alias)
+    return report
+
+def index_oeaz(_client: Client, query:Dict) -> BulkReport:
+    return _rebuild(_client, OEAZ_INDICES, OeazArticle.get_dicts_by_query(query), OeazArticle, oeaz_actions, "oeaz")
+
+def index_aco(_client: Client, query:Dict) -> BulkReport:
+    return _rebuild(_client, ACO_INDICES, ACOMeta.get_dicts_by_query(query), ACOMeta, aco_actions, "aco")
 
 def check_mapping(_client: Client, index_name: str) -> Dict:
     mapping = _client.es.indices.get_mapping(index=index_name)
@@ -95,20 +133,32 @@ def check_mapping(_client: Client, index_name: str) -> Dict:
 
 
 def reindex_oeaz_aco():
-    _client = Client()
-    index_aco(_client=_client, query={"processed": 2})
-    index_oeaz(_client=_client, query = {"rubrik": {"$regex": ".*Tara.*", '$options': 'i'}, "processed" : 2})
+    from search.sync import set_watermark
+    _client = get_client()
+    _client.check()
+    started = datetime.datetime.now(datetime.timezone.utc)
+    index_aco(_client=_client, query=ACO_QUERY)
+    set_watermark("aco", started)
+    started = datetime.datetime.now(datetime.timezone.utc)
+    index_oeaz(_client=_client, query=OEAZ_QUERY)
+    set_watermark("oeaz", started)
+    NavTree.rebuild_stale()
+    purge_pages()
 
 
+def typeahead_query(field:str, query:str) -> Dict:
+    return {
+        "bool": {
+            "must": {"match": {f"{field}.prefix": {"query": query, "operator": "and"}}},
+            "should": {"match": {field: query}} # full word matches rank first
+        }
+    }
+
 def search_aco_wirkstoff(_client:Client, query):
     op = _client.es.search(
         index="aco_actives",
-        query={
-            "query_string": {
-                "fields": ["bezeichnung"],
-                'query': f'*{query.replace(" ", "*")}*' #todo: needs love
-            }
-        },
+        query=typeahead_query("bezeichnung", query),
+        size=TYPEAHEAD_SIZE,
         source_includes=["id", "bezeichnung"]
     )
     result = []
@@ -122,14 +172,10 @@ def search_aco_wirkstoff(_client:Client, query):
     return result
 
 def search_aco_bezeichnung(query):
-    op = _client.es.search(
+    op = get_client().es.search(
         index="aco",
-        query={
-            "query_string": {
-                "fields": ["bezeichnung"],
-                'query': f'*{query.replace(" ", "*")}*'  # todo: needs love
-            }
-        },
+        query=typeahead_query("bezeichnung", query),
+        size=TYPEAHEAD_SIZE,
         source_includes=["id", "bezeichnung"]
     )
     result = []
@@ -142,66 +188,62 @@ def search_aco_bezeichnung(query):
         })
     return result
 
+OEAZ_TYPEAHEAD = {
+    # alias: (field, icon)
+    "oeaz_products": ("product", "bi bi-capsule"),
+    "oeaz_substances": ("substance", "bi bi-prescription2"),
+    "oeaz_diseases": ("disease", "bi bi-virus2"),
+}
+
 def search_oeaz_bezeichnung(query):
-    result = []
-    query = f"*{re.sub('^[^a-zA-ZäöüÄÖÜß]+','*', query)}*"
-    op = _client.es.search(
-        index="oeaz_products",
+    """
+    one query over all keyword indices, es returns the best hit per article (collapse on id), best first
+    """
+    op = get_client().es.search(
+        index=",".join(OEAZ_TYPEAHEAD),
         query={
-            "query_string": {
-                "fields": ["product"],
-                'query': query #todo: needs love
+            "bool": {
+                "should": [typeahead_query(field, query) for field, _ in OEAZ_TYPEAHEAD.values()],
+                "minimum_should_match": 1
             }
         },
-        source_includes=["id", "product", "title"]
+        collapse={"field": "id"},
+        size=TYPEAHEAD_SIZE,
+        source_includes=["id", "title"] + [field for field, _ in OEAZ_TYPEAHEAD.values()]
     )
+    result = []
     for hit in op.raw['hits']["hits"]:
+        field, icon = next((f, i) for f, i in OEAZ_TYPEAHEAD.values() if f in hit["_source"])
         result.append({
-            "name": hit["_source"]["product"] + " - " + hit["_source"]["title"],
+            "name": hit["_source"][field] + " - " + hit["_source"]["title"],
             "id": hit["_source"]["id"],
             "score": hit["_score"],
-            "icon": "bi bi-capsule"
+            "icon": icon
         })
+    logger.info(f"size: {len(result)}")
+    return result
 
-    wirkstoffe = re.sub('^[^a-zA-ZäöüÄÖÜß ]+',"*", query)
-    op = _client.es.search(
-        index="oeaz_substances",
-        query={
-            "query_string": {
-                "fields": ["substance"],
-                'query': query #todo: needs love
-            }
-        },
-        source_includes=["id", "substance", "title"]
-    )
-    for hit in op.raw['hits']["hits"]:
-        result.append({
-            "name": hit["_source"]["substance"] + " - " + hit["_source"]["title"],
-            "id": hit["_source"]["id"],
-            "score": hit["_score"],
-            "icon": "bi bi-prescription2"
-        })
 
-    disease = re.sub('^[^a-zA-ZäöüÄÖÜß ]+',"*", query)
-    op = _client.es.search(
-        index="oeaz_diseases",
-        query={
-            "query_string": {
-                "fields": ["disease"],
-                'query': query #todo: needs love
-            }
-        },
-        source_includes=["id", "disease", "title"]
-    )
-    for hit in op.raw['hits']["hits"]:
-        result.append({
-            "name": hit["_source"]["disease"] + " - " + hit["_source"]["title"],
-            "id": hit["_source"]["id"],
-            "score": hit["_score"],
-            "icon": "bi bi-virus2"
-        })
-    logger.info(f"size: {len(result)}")
-    return  sorted(result, key=lambda x: x["score"])
+typeahead_cache = TTLCache(maxsize=TYPEAHEAD_CACHE_SIZE, ttl=TYPEAHEAD_CACHE_TTL)
+_generation_cache = TTLCache(maxsize=16, ttl=GENERATION_TTL)
+
+def index_generation(aliases:Iterable[str]) -> tuple:
+    aliases = tuple(aliases)
+    return _generation_cache.get_or_load(
+        aliases, lambda: tuple(g for alias in aliases for g in active_generations(get_client().es, alias)))
+
+def normalize_query(query:str) -> str:
+    return " ".join(query.lower().split())
+
+def cached_search_aco_bezeichnung(query):
+    query = normalize_query(query)
+    key = ("aco", index_generation(["aco"]), query)
+    return typeahead_cache.get_or_load(key, lambda: search_aco_bezeichnung(query))
+
+def cached_search_oeaz_bezeichnung(query):
+    query = normalize_query(query)
+    key = ("oeaz", index_generation(OEAZ_INDICES), query)
+    return typeahead_cache.get_or_load(key, lambda: search_oeaz_bezeichnung(query))
 
 
 # def search_articles_by_aco(aco_id:int):
@@ -269,77 +311,68 @@ def search_oeaz_bezeichnung(query):
 #         })
 #     return result
 
+RELATED_CATEGORIES = [
+    # (category, index, field)
+    ("Produkte", "oeaz_products", "product"),
+    ("Wirkstoffe", "oeaz_substances", "substance"),
+    ("Krankheitsbilder", "oeaz_diseases", "disease"),
+]
+RELATED_PROJECTION = {"html_raw": 0, "html_body": 0}
+
 def search_articles(aco:ACOMeta):
     cutoff = 8.0
-    #search in products
-    result = {
-        "Produkte": [],
-        "Wirkstoffe": [],
-        "Krankheitsbilder": []
+    result = {cat: [] for cat, _, _ in RELATED_CATEGORIES}
+    queries = {
+        "Produkte": re.sub('[^a-zA-ZäöüÄÖÜß]+'," ", aco.bezeichnung),
+        "Wirkstoffe": " ".join([re.sub('[^a-zA-ZäöüÄÖÜß]+'," ", ws.bezeichnung) for ws in aco.wirkstoffe]),
+        "Krankheitsbilder": " ".join([re.sub('[^a-zA-ZäöüÄÖÜß ]+'," ", kt.text) for kt in aco.kurztexte
+                                      if kt.bezeichnung=='Anwendungsgebiete' and kt.text is not None]),
     }
-    bezeichnung = re.sub('[^a-zA-ZäöüÄÖÜß]+'," ", aco.bezeichnung)
-    logger.info(f"product: {bezeichnung}")
-    op = _client.es.search(
-        index="oeaz_products",
-        query={
-            "query_string": {
-                "fields": ["product"],
-                'query': f'{bezeichnung}' #todo: needs love
-            }
-        },
-        source_includes=["id", "product"]
-    )
-    for hit in op.raw['hits']["hits"]:
-        if hit["_score"] < cutoff: continue
-        result["Produkte"].append({
-            "article": OeazArticle.get(hit["_source"]["id"]),
-            "hit": hit["_source"]["product"],
-            "score": hit["_score"]
-        })
+    logger.info(f"related queries: {queries}")
 
-    wirkstoffe = " ".join([re.sub('[^a-zA-ZäöüÄÖÜß]+'," ", ws.bezeichnung) for ws in aco.wirkstoffe])
-    logger.info(f"wirkstoffe: {wirkstoffe}")
-    op = _client.es.search(
-        index="oeaz_substances",
-        query={
-            "query_string": {
-                "fields": ["substance"],
-                'query': wirkstoffe #todo: needs love
-            }
-        },
-        source_includes=["id", "substance"]
-    )
-    for hit in op.raw['hits']["hits"]:
-        if hit["_score"] < cutoff: continue
-        result["Wirkstoffe"].append({
-            "article": OeazArticle.get(hit["_source"]["id"]),
-            "hit": hit["_source"]["substance"],
-            "score": hit["_score"]
+    # one _msearch for all categories, empty queries are skipped
+    searches = []
+    categories = []
+    for cat, index, field in RELATED_CATEGORIES:
+        if not queries[cat].strip(): continue
+        searches.append({"index": index})
+        searches.append({
+            "query": {
+                "query_string": {
+                    "fields": [field],
+                    'query': queries[cat] #todo: needs love
+                }
+            },
+            "min_score": cutoff,
+            "_source": ["id", field]
         })
+        categories.append((cat, field))
+    if not searches:
+        return result
+    op = get_client().es.msearch(searches=searches)
 
-    disease = " ".join([re.sub('[^a-zA-ZäöüÄÖÜß ]+'," ", kt.text) for kt in aco.kurztexte if kt.bezeichnung=='Anwendungsgebiete'])
-    logger.info(f"disease: {disease}")
-    op = _client.es.search(
-        index="oeaz_diseases",
-        query={
-            "query_string": {
-                "fields": ["disease"],
-                'query': disease #todo: needs love
-            }
-        },
-        source_includes=["id", "disease"]
-    )
-    for hit in op.raw['hits']["hits"]:
-        if hit["_score"] < cutoff: continue
-        result["Krankheitsbilder"].append({
-            "article": OeazArticle.get(hit["_source"]["id"]),
-            "hit": hit["_source"]["disease"],
-            "score": hit["_score"]
+    hits = []
+    for (cat, field), response in zip(categories, op.raw["responses"]):
+        if "error" in response:
+            logger.warning(f"related search for {cat} failed: {response['error']}")
+            continue
+        for hit in response["hits"]["hits"]:
+            if hit["_score"] < cutoff: continue
+            hits.append((cat, hit["_source"]["id"], hit["_source"][field], hit["_score"]))
+
+    # one projected fetch for all referenced articles (without html_raw)
+    articles = OeazArticle.get_many(list({h[1] for h in hits}), projection=RELATED_PROJECTION)
+    for cat, article_id, keyword, score in hits:
+        if article_id not in articles: continue
+        result[cat].append({
+            "article": articles[article_id],
+            "hit": keyword,
+            "score": score
         })
     return result
 
 def test_articles_for_aco(aco:ACOMeta):
-    test2 = search_articles(_client=_client, aco=aco)
+    test2 = search_articles(aco)
     print(f'Test was for query -{aco.bezeichnung}-')
     print(f'ws: {[ws.bezeichnung for ws in aco.wirkstoffe]}')
     print(f'aw: {[kt.text for kt in aco.kurztexte if kt.bezeichnung=="Anwendungsgebiete"]}')
@@ -349,7 +382,5 @@ def test_articles_for_aco(aco:ACOMeta):
             print(f'[{entry["score"]}] {entry[cat]}: {entry["article"].title}')
 
 
-_client = Client()
-
 
 #search_oeaz_bezeichnung("dep")
\ No newline at end of file
@@ -0,0 +1,72 @@
+import re
+from typing import Dict, List
+
+from elasticsearch import Elasticsearch
+
+import settings
+from search.mappings import INDEX_SETTINGS
+
+logger = settings.logger
+
+# every index is a generation <alias>_v<n>, readers only ever use the alias
+KEEP_GENERATIONS = 1 # inactive generations kept for rollback
+
+
+def generation_number(alias: str, index: str) -> int:
+    m = re.fullmatch(rf"{re.escape(alias)}_v(\d+)", index)
+    return int(m.group(1)) if m else -1
+
+
+def list_generations(es: Elasticsearch, alias: str) -> List[str]:
+    indices = [i for i in es.indices.get(index=f"{alias}_v*").keys() if generation_number(alias, i) >= 0]
+    return sorted(indices, key=lambda i: generation_number(alias, i))
+
+
+def active_generations(es: Elasticsearch, alias: str) -> List[str]:
+    if not es.indices.exists_alias(name=alias): return []
+    return list(es.indices.get_alias(name=alias).keys())
+
+
+def create_generation(es: Elasticsearch, alias: str, mappings: Dict) -> str:
+    generations = list_generations(es, alias)
+    n = generation_number(alias, generations[-1]) + 1 if generations else 1
+    index = f"{alias}_v{n}"
+    # build without replicas and refreshes, both are switched on in publish()
+    es.indices.create(index=index,
+                      settings={**INDEX_SETTINGS, "number_of_replicas": 0, "refresh_interval": "-1"},
+                      mappings=mappings)
+    logger.info(f"created generation {index}")
+    return index
+
+
+def drop_generations(es: Elasticsearch, indices: List[str]) -> None:
+    for index in indices:
+        es.indices.delete(index=index, ignore_unavailable=True)
+        logger.info(f"dropped generation {index}")
+
+
+def publish(es: Elasticsearch, targets: Dict[str, str]) -> None:
+    """
+    swaps all aliases of targets (alias -> new generation) in one atomic update_aliases call
+    """
+    actions = []
+    for alias, index in targets.items():
+        es.indices.put_settings(index=index, settings={
+            "number_of_replicas": settings.ELASTIC_REPLICAS,
+            "refresh_interval": None
+        })
+        es.indices.refresh(index=index)
+        if es.indices.exists_alias(name=alias):
+            actions.append({"remove": {"index": "*", "alias": alias}})
+        elif es.indices.exists(index=alias):
+            # pre-alias index with the alias' name
+            actions.append({"remove_index": {"index": alias}})
+        actions.append({"add": {"index": index, "alias": alias}})
+    es.indices.update_aliases(actions=actions)
+    logger.info(f"published {targets}")
+
+
+def collect_garbage(es: Elasticsearch, alias: str, keep: int = KEEP_GENERATIONS) -> None:
+    active = set(active_generations(es, alias))
+    inactive = [i for i in list_generations(es, alias) if i not in active]
+    drop_generations(es, inactive[:max(0, len(inactive) - keep)])
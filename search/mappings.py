@@ -0,0 +1,85 @@
+from typing import Dict
+
+# edge-ngrams are built at index time, so typeahead lookups are plain term matches
+# instead of leading-wildcard scans over the term dictionary
+TYPEAHEAD_MAX_GRAM = 20
+
+INDEX_SETTINGS = {
+    "analysis": {
+        "tokenizer": {
+            "typeahead_edge": {
+                "type": "edge_ngram",
+                "min_gram": 1,
+                "max_gram": TYPEAHEAD_MAX_GRAM,
+                "token_chars": ["letter", "digit"]
+            }
+        },
+        "filter": {
+            "typeahead_truncate": {
+                "type": "truncate",
+                "length": TYPEAHEAD_MAX_GRAM
+            }
+        },
+        "analyzer": {
+            "typeahead": {
+                "type": "custom",
+                "tokenizer": "typeahead_edge",
+                "filter": ["lowercase", "asciifolding"]
+            },
+            "typeahead_search": {
+                "type": "custom",
+                "tokenizer": "standard",
+                "filter": ["lowercase", "asciifolding", "typeahead_truncate"]
+            }
+        }
+    }
+}
+
+
+def typeahead_field() -> Dict:
+    return {
+        "type": "text",
+        "fields": {
+            "prefix": {
+                "type": "text",
+                "analyzer": "typeahead",
+                "search_analyzer": "typeahead_search"
+            },
+            "keyword": {
+                "type": "keyword",
+                "ignore_above": 256
+            }
+        }
+    }
+
+
+ACO_MAPPINGS = {
+    "properties": {
+        "id": {"type": "long"},
+        "bezeichnung": typeahead_field(),
+        "anwendung": {"type": "text"},
+        "warn": {"type": "text"},
+    }
+}
+
+ACO_ACTIVES_MAPPINGS = {
+    "properties": {
+        "id": {"type": "long"},
+        "bezeichnung": typeahead_field(),
+    }
+}
+
+
+def oeaz_keyword_mappings(field: str) -> Dict:
+    return {
+        "properties": {
+            "id": {"type": "long"},
+            field: typeahead_field(),
+            "title": {"type": "text", "index": False},
+        }
+    }
+
+
+OEAZ_PRODUCTS_MAPPINGS = oeaz_keyword_mappings("product")
+OEAZ_SUBSTANCES_MAPPINGS = oeaz_keyword_mappings("substance")
+OEAZ_DISEASES_MAPPINGS = oeaz_keyword_mappings("disease")
@@ -0,0 +1,127 @@
+import argparse
+import datetime
+import time
+from typing import Dict, Callable, Generator, List, Union
+
+from pydantic import BaseModel, ConfigDict
+
+import settings
+from db.mongo import aco, oeaz_article, tombstones, sync_state, LazyCollection
+from helpers.page_cache import purge_pages
+from models.aco import ACOMeta
+from models.nav_tree import NavTree
+from models.oeaz_structured import OeazArticle
+from search.bulk import bulk_index, chunked
+from search.elastic import Client, get_client, ACO_QUERY, OEAZ_QUERY, ACO_INDICES, OEAZ_INDICES, aco_actions, oeaz_actions
+
+logger = settings.logger
+
+SYNC_INTERVAL = 60 # seconds between runs in loop mode
+# changes are re-read with this overlap, upserts are idempotent and writers' clocks may drift a little
+OVERLAP = datetime.timedelta(seconds=5)
+BATCH_SIZE = 500
+
+
+class SyncSource(BaseModel):
+    name: str
+    collection: LazyCollection
+    query: Dict
+    model: type
+    to_actions: Callable
+    aliases: List[str]
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+
+SOURCES = {
+    "aco": SyncSource(name="aco", collection=aco, query=ACO_QUERY, model=ACOMeta,
+                      to_actions=aco_actions, aliases=list(ACO_INDICES)),
+    "oeaz": SyncSource(name="oeaz", collection=oeaz_article, query=OEAZ_QUERY, model=OeazArticle,
+                       to_actions=oeaz_actions, aliases=list(OEAZ_INDICES)),
+}
+
+
+def get_watermark(name: str) -> Union[datetime.datetime, None]:
+    state = sync_state.find_one({"name": name})
+    if state is None: return None
+    return state["watermark"]
+
+
+def set_watermark(name: str, watermark: datetime.datetime, seen: List[List] = ()) -> None:
+    """
+    seen are the [id, updated_at] pairs already synced inside the overlap window below watermark
+    """
+    sync_state.update_one({"name": name}, {"$set": {"watermark": watermark, "seen": list(seen)}}, upsert=True)
+
+
+def _changed_ids(source: SyncSource, since: datetime.datetime) -> Generator[Dict, None, None]:
+    changed = {"updated_at": {"$gte": since}}
+    yield from source.collection.find(changed, {"_id": 0, "id": 1, "updated_at": 1})
+    yield from tombstones.find({**changed, "collection": source.collection.name}, {"_id": 0, "id": 1, "updated_at": 1})
+
+
+def sync_source(_client: Client, source: SyncSource) -> int:
+    """
+    removes the es documents of everything changed since the stored watermark and indexes
+    the changed documents that (still) match the source query again; documents re-read in the
+    overlap window are skipped when they were synced with the same updated_at before
+    """
+    state = sync_state.find_one({"name": source.name})
+    if state is None or state.get("watermark") is None:
+        logger.warning(f"{source.name}: no watermark, run a full reindex first")
+        return 0
+    watermark = state["watermark"]
+    seen = {(id, updated_at) for id, updated_at in state.get("seen", [])}
+    since = watermark - OVERLAP
+    changed = 0
+    newest = watermark
+    unseen = (d for d in _changed_ids(source, since) if (d["id"], d["updated_at"]) not in seen)
+    for batch in chunked(unseen, BATCH_SIZE):
+        ids = list({d["id"] for d in batch})
+        _client.es.delete_by_query(index=",".join(source.aliases), query={"terms": {"id": ids}}, conflicts="proceed")
+        docs = source.collection.find({"$and": [{"id": {"$in": ids}}, source.query]})
+        actions = (action for doc in docs for action in source.to_actions(source.model(**doc)))
+        report = bulk_index(_client.es, actions, label=f"sync {source.name}")
+        if report.failed:
+            # the batch is already deleted from es: keep the watermark so the next run repeats it
+            raise RuntimeError(f"{source.name}: {report.failed} documents failed to index, watermark kept at {watermark}")
+        newest = max([newest] + [d["updated_at"] for d in batch])
+        seen.update((d["id"], d["updated_at"]) for d in batch)
+        changed += len(ids)
+    # pairs still inside the next run's overlap window, they must not count as changed again
+    window = [[id, updated_at] for id, updated_at in seen if updated_at >= newest - OVERLAP]
+    if changed:
+        # single saves and deletes only stamp updated_at, their tree is refreshed here
+        NavTree.mark_stale(source.name)
+    # only advanced after a complete run, an interrupted run is simply repeated
+    set_watermark(source.name, newest, window)
+    logger.info(f"{source.name}: synced {changed} changed documents, watermark {newest}")
+    return changed
+
+
+def sync_once(_client: Client) -> int:
+    changed = sum(sync_source(_client, source) for source in SOURCES.values())
+    NavTree.rebuild_stale()
+    if changed:
+        purge_pages()
+    return changed
+
+
+def sync_loop(_client: Client, interval: int = SYNC_INTERVAL) -> None:
+    while True:
+        try:
+            sync_once(_client)
+        except Exception as e:
+            logger.exception("sync failed")
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="incremental mongo -> elasticsearch sync")
+    parser.add_argument("--loop", action="store_true", help="keep syncing every --interval seconds")
+    parser.add_argument("--interval", type=int, default=SYNC_INTERVAL)
+    args = parser.parse_args()
+    if args.loop:
+        sync_loop(get_client(), interval=args.interval)
+    else:
+        sync_once(get_client())
@@ -29,6 +29,7 @@ OEAZ_ONLINE_STAGING_API = os.environ.get("OEAZ_ONLINE_STAGING_API", None)
 OEAZ_ONLINE_API = os.environ.get("OEAZ_ONLINE_API", None)
 ACO_API = os.environ.get('ACO_API', None)
 ELASTIC = os.environ.get('ELASTIC', None)
+ELASTIC_REPLICAS = int(os.environ.get('ELASTIC_REPLICAS', 1))
 # todo: put models to a volume
 # todo: models loaded will always pull huggingface - should be local
 #os.environ["TRANSFORMERS_OFFLINE"] = "1"